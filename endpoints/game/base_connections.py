@@ -1,34 +1,63 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
+import uuid
+from functools import partial
 
+import tornado.ioloop
 from tornado import gen
 from sockjs.tornado import SockJSConnection
 
 from clients import redis_client
+from redis_scripts import (
+    lobby_script, lobby_page_script, create_player_script, resume_script,
+    expire_player_script)
+from utils import lobby_key, lobby_keys, open_games_key
+import metrics
+import routing
+import settings
 
 
 class MultiParticipantsConnection(SockJSConnection):
     """Connection, which save participants and support additional
-    methods for working with participants.
+    methods for working with participants. Participants are indexed by
+    the multiplex channel name (or by the class for connections without
+    channel), so broadcasts touch their recipients only.
     """
-    participants = set()
+    participants = {}
+
+    @property
+    def participants_key(self):
+        return getattr(self.session, 'name', self.__class__)
 
     def on_open(self, info):
-        self.participants.add(self)
+        self.participants.setdefault(self.participants_key, set()).add(self)
         super().on_open(info)
 
     def broadcast_all(self, message):
         """Broadcast message to all participants."""
-        target_class = self.__class__
-        targets = [i for i in self.participants if isinstance(i, target_class)]
+        targets = self.participants.get(self.participants_key, set())
         self.broadcast(targets, message)
 
     def on_close(self):
-        self.participants.remove(self)
+        targets = self.participants.get(self.participants_key, set())
+        targets.discard(self)
+        if not targets:
+            self.participants.pop(self.participants_key, None)
         super().on_close()
 
 
+def publish_broadcast(channel, message):
+    """Send message to all participants of the channel on all server
+    processes (see `deliver_broadcast`).
+    """
+    routing.publish('broadcast', json.dumps({
+        'channel': channel,
+        'message': message
+    }))
+
+
 class ChannelConnection(SockJSConnection):
     """Connection, for working with multiplex channels."""
     def send_channel(self, channel, message, binary=False):
@@ -44,12 +73,9 @@ class ChannelConnection(SockJSConnection):
 
     def broadcast_all_channel(self, channel, message):
         """Broadcast message to all participants for the specific
-        channel. This method expects, that `participants` property is
-        already exists (using, for example, `MultiParticipantsConnection`).
+        channel on all server processes.
         """
-        target_class = self.__class__
-        targets = [i for i in self.participants if isinstance(i, target_class)]
-        self.session.broadcast_channel(channel, targets, message)
+        publish_broadcast(channel, message)
 
 
 class ErrorConnection(SockJSConnection):
@@ -60,6 +86,7 @@ class ErrorConnection(SockJSConnection):
         else:
             errors = [message]
 
+        metrics.handler_errors.inc(metrics.channel_name(self))
         self.send(json.dumps(
             {
                 'status': 'error',
@@ -68,45 +95,135 @@ class ErrorConnection(SockJSConnection):
         ))
 
 
+def deliver_broadcast(data):
+    """Send message published by `publish_broadcast` to all
+    participants of the channel on the current server.
+    """
+    data = json.loads(data)
+    targets = MultiParticipantsConnection.participants.get(data['channel'])
+    if targets:
+        next(iter(targets)).broadcast_channel(
+            data['channel'], targets, data['message'])
+
+
+def deliver_player_message(username, data):
+    """Send message published by `RemotePlayer` to the player, if the
+    player is connected to the current server.
+    """
+    player = BaseConnection.players.get(username)
+    if player is not None:
+        data = json.loads(data)
+        player.send_channel(data['channel'], data['message'])
+
+
+def subscribe_broadcasts():
+    routing.subscribe('broadcast', deliver_broadcast)
+
+
+class RemotePlayer:
+    """Player connected to another server process (or already gone).
+    Messages go through the player's redis channel.
+    """
+    def __init__(self, username):
+        self.username = username
+
+    def send_channel(self, channel, message, binary=False):
+        routing.publish(
+            'players:channel:{}'.format(self.username),
+            json.dumps({'channel': channel, 'message': message}))
+
+
 class BaseConnection(ChannelConnection, MultiParticipantsConnection, ErrorConnection):
     """Base connection for working with sockets."""
 
     players = {}
+    games_cache = {}
+    # Generation of the player's session, changed by every resume.
+    generation = 0
 
-    @gen.coroutine
     def on_close(self):
         super().on_close()
-        yield self.remove_player()
+        if self.is_logged and self.players.get(self.username) is self:
+            # Player has `RESUME_GRACE` seconds to resume the session.
+            io_loop = tornado.ioloop.IOLoop.instance()
+            io_loop.add_timeout(
+                time.time() + settings.RESUME_GRACE,
+                partial(self.remove_player, self.generation))
 
     @gen.coroutine
     def create_player(self, username):
-        """Create player for current connection."""
-        raw_data = yield gen.Task(redis_client.incr, 'players:counter')
+        """Create player for current connection. Return False if someone
+        already has the username.
+        """
+        token = uuid.uuid4().hex
+        raw_data = yield gen.Task(
+            create_player_script,
+            ['players:all', 'players:seen', 'players:counter',
+             'players:token:{}'.format(token)],
+            [username, token, int(time.time())])
+        if raw_data is None:
+            return False
+
         self.user_id = int(raw_data)
+        self.token = token
+        self.bind_player(username)
+        return True
 
-        yield gen.Task(
-            redis_client.set,
-            'players:id:{}'.format(self.user_id), username)
-        yield gen.Task(redis_client.sadd, 'players:all', username)
+    @gen.coroutine
+    def resume_player(self, token):
+        """Bind player of the disconnected session to current connection.
+        Return False if there is no such session (or it's expired).
+        """
+        raw_data = yield gen.Task(
+            resume_script, ['players:token:{}'.format(token)], [])
+        if raw_data is None:
+            return False
+
+        username = raw_data[0].decode('utf-8')
+        self.generation = raw_data[1]
+        self.user_id = int(raw_data[2])
+        self.token = token
+        self.bind_player(username)
+        return True
 
+    def bind_player(self, username):
         self.players[username] = self
         self.username = username
+        routing.subscribe(
+            'players:channel:{}'.format(username),
+            partial(deliver_player_message, username))
 
     @gen.coroutine
-    def remove_player(self):
-        """Remove player for current connection."""
-        if self.is_logged:
-            yield gen.Task(
-                redis_client.delete, 'players:id:{}'.format(self.user_id))
-            yield gen.Task(redis_client.srem, 'players:all', self.username)
-            del self.players[self.username]
-            self.username = None
+    def remove_player(self, generation):
+        """Remove player of the closed connection, if the session wasn't
+        resumed after it (see `resume_player`).
+        """
+        username = self.username
+        removed = yield gen.Task(
+            expire_player_script,
+            ['players:session:{}'.format(username), 'players:all',
+             'players:token:{}'.format(self.token),
+             'players:id:{}'.format(self.user_id), 'players:seen',
+             open_games_key(username)],
+            [username, generation])
+        broadcast_lobby_removals(removed or [])
+
+        # The session may be resumed by another connection of this server.
+        if self.players.get(username) is self:
+            routing.unsubscribe('players:channel:{}'.format(username))
+            del self.players[username]
+        self.username = None
 
     def get_player(self, username):
         """Get player by username from all connections on the
-        current server.
+        current server, or `RemotePlayer` for players of other servers
+        (and for the disconnected ones, the session may be resumed on
+        another server).
         """
-        return self.players.get(username)
+        player = self.players.get(username)
+        if player is None or player.is_closed:
+            return RemotePlayer(username)
+        return player
 
     @property
     def is_logged(self):
@@ -125,19 +242,85 @@ class BaseConnection(ChannelConnection, MultiParticipantsConnection, ErrorConnec
             setattr(self.session.base, 'username', value)
 
     @gen.coroutine
-    def get_games(self):
-        """Return serialized list of games."""
-        games = []
-        raw_data = yield gen.Task(redis_client.smembers, 'games:all')
-        for game_id, title in [i.decode('utf-8').split(":", 1) for i in raw_data]:
-            games.append({
-                'game_id': int(game_id),
-                'title': title
-            })
-
-        answer = {
-            'status': 'ok',
-            'games': sorted(games, key=lambda obj: obj.get('game_id'))
-        }
-        # TODO: is it ok to use return?
-        return json.dumps(answer)
+    def get_games(self, offset=0, limit=None, filters=None):
+        """Return serialized page of the list of games, optionally
+        filtered (see `utils.LOBBY_FILTERS`). Pages are cached until the
+        next change of the list (see `change_games`).
+        """
+        limit = limit or settings.LOBBY_PAGE_SIZE
+        filters = filters or {}
+
+        version = yield gen.Task(redis_client.get, 'games:version')
+        version = int(version or 0)
+
+        if self.games_cache.get('version') != version or \
+                len(self.games_cache['pages']) >= settings.LOBBY_CACHE_SIZE:
+            self.games_cache.update(version=version, pages={})
+
+        key = lobby_key(filters)
+        pages = self.games_cache['pages']
+        if (key, offset, limit) not in pages:
+            total, raw_data = yield gen.Task(
+                lobby_page_script, [key, 'games:lobby:games'],
+                [offset, limit])
+
+            answer = {
+                'status': 'ok',
+                'version': version,
+                'offset': offset,
+                'limit': limit,
+                'total': total,
+                'games': [json.loads(i.decode('utf-8')) for i in raw_data]
+            }
+            pages[(key, offset, limit)] = json.dumps(answer)
+
+        return pages[(key, offset, limit)]
+
+    @gen.coroutine
+    def change_games(self, game, added):
+        """Add game to (or remove from) the list of games (see
+        `change_lobby`).
+        """
+        yield change_lobby(game, added)
+
+
+@gen.coroutine
+def change_lobby(game, added, broadcast=True):
+    """Add game to (or remove from) the list of games and broadcast
+    the change to all `games_list` participants. Clients, which missed
+    some versions, should ask for the list again.
+
+    `game` is a dict with game_id, title, creator, dimension, lineup and
+    color.
+    """
+    version = yield gen.Task(
+        lobby_script,
+        ['games:version', 'games:lobby:games', 'games:lobby:keys'] +
+        lobby_keys(game) + [open_games_key(game['creator'])],
+        ['add' if added else 'remove', game['game_id'], json.dumps(game)])
+    if not broadcast:
+        return
+
+    answer = {
+        'status': 'ok',
+        'version': version
+    }
+    if added:
+        answer['added'] = [game]
+    else:
+        answer['removed'] = [game['game_id']]
+    publish_broadcast('games_list', json.dumps(answer))
+
+
+def broadcast_lobby_removals(removed):
+    """Broadcast removals of the games made by redis scripts (see
+    `redis_scripts.REMOVE_FROM_LOBBY`). `removed` is list of [game id,
+    version], version is None for the games, which weren't in the lobby.
+    """
+    for game_id, version in removed:
+        if version is not None:
+            publish_broadcast('games_list', json.dumps({
+                'status': 'ok',
+                'version': version,
+                'removed': [int(game_id)]
+            }))
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks of the rules engine (`play.Game`).
+
+Every allowed dimension and lineup is measured on the seeded random
+games (and on the recorded games, if any):
+
+    action - replay of the whole game move by move,
+    is_lineup - check of every move on the final board,
+    is_filled - check of the final board,
+    serialize_cells - serialization of the final board,
+    bitmaps - compact snapshot of the final board.
+
+Results are ops/sec and the speed relative to the fixed reference work
+(best of the repeats) and, with `tracemalloc`, the peak of the allocated
+memory per operation. Save them and compare next runs with them (the
+relative speeds are compared, so the baseline of the other machine can
+be used too):
+
+    $ python endpoints/game/benchmark.py --output=baseline.json
+    $ python endpoints/game/benchmark.py --baseline=baseline.json
+
+The full run takes about 25 minutes, narrow it down with
+`--min-dimension`, `--max-dimension` and `--benchmarks`.
+
+Recorded games are JSON list of {"dimension", "lineup", "moves"}, where
+`moves` are [x, y] pairs (black moves first).
+"""
+
+import argparse
+import gc
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from play import Game
+
+BENCHMARKS = [
+    'action', 'is_lineup', 'is_filled', 'serialize_cells', 'bitmaps']
+
+# Seconds of the benchmark (and of the reference) run in turn.
+SLICE_TIME = 0.02
+
+
+def random_game(dimension, lineup, seed):
+    """Return moves ([x, y, color]) of the random game till its end."""
+    rand = random.Random(seed)
+    cells = [
+        (x, y)
+        for x in range(1, dimension + 1) for y in range(1, dimension + 1)
+    ]
+    rand.shuffle(cells)
+
+    game, moves = Game(None, dimension, lineup), []
+    for i, (x, y) in enumerate(cells):
+        color = 1 - i % 2
+        moves.append((x, y, color))
+        ok, status = game.action(x, y, color)
+        if status is not None:
+            break
+    return moves
+
+
+def recorded_games(path):
+    with open(path) as f:
+        for data in json.load(f):
+            moves = [
+                (x, y, 1 - i % 2) for i, (x, y) in enumerate(data['moves'])]
+            yield data['dimension'], data['lineup'], moves
+
+
+def replay(dimension, lineup, moves):
+    game = Game(None, dimension, lineup)
+    for x, y, color in moves:
+        game.action(x, y, color)
+    return game
+
+
+def operations(name, dimension, lineup, moves):
+    """Return (function, number of operations per call) of the
+    benchmark.
+    """
+    final = replay(dimension, lineup, moves)
+
+    if name == 'action':
+        return lambda: replay(dimension, lineup, moves), len(moves)
+
+    if name == 'is_lineup':
+        def run():
+            for x, y, color in moves:
+                final.is_lineup(x, y, color)
+        return run, len(moves)
+
+    if name == 'is_filled':
+        return final.is_filled, 1
+
+    if name == 'serialize_cells':
+        return final.serialize_cells, 1
+
+    if name == 'bitmaps':
+        return final.bitmaps, 1
+
+
+def reference():
+    """Fixed pure Python work, the speed of the machine is measured by
+    it.
+    """
+    total = 0
+    for i in range(1000):
+        total += i * i
+    return total
+
+
+def timed(function, min_time):
+    """Return number of calls of `function` and their time, which is
+    `min_time` seconds at least.
+    """
+    calls, elapsed = 0, 0
+    while elapsed < min_time:
+        started = time.perf_counter()
+        function()
+        elapsed += time.perf_counter() - started
+        calls += 1
+    return calls, elapsed
+
+
+def measure(function, ops, min_time):
+    """Return ops/sec of `function` and its speed relative to the
+    `reference` one. Slices of the benchmark and of the reference take
+    turns (half of `min_time` each), so both are measured at the same
+    speed of the machine, which changes a lot on the shared hosts.
+    Garbage collector is disabled, as in `timeit`.
+    """
+    calls = elapsed = reference_calls = reference_elapsed = 0
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while elapsed < min_time / 2:
+            count, seconds = timed(function, SLICE_TIME)
+            calls, elapsed = calls + count, elapsed + seconds
+            count, seconds = timed(reference, SLICE_TIME)
+            reference_calls += count
+            reference_elapsed += seconds
+    finally:
+        if enabled:
+            gc.enable()
+    speed = calls * ops / elapsed
+    return speed, speed / (reference_calls / reference_elapsed)
+
+
+def allocated(function, ops):
+    """Return peak allocated bytes per operation."""
+    tracemalloc.start()
+    function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return round(peak / ops, 1)
+
+
+def run(options):
+    games = []
+    for dimension in range(options.min_dimension, options.max_dimension + 1):
+        for lineup in range(3, dimension + 1):
+            moves = random_game(
+                dimension, lineup, options.seed + dimension * 100 + lineup)
+            games.append(
+                ('random:{}x{}:{}'.format(dimension, dimension, lineup),
+                 dimension, lineup, moves))
+    if options.recorded:
+        for i, (dimension, lineup, moves) in enumerate(
+                recorded_games(options.recorded)):
+            games.append(
+                ('recorded:{}:{}x{}:{}'.format(
+                    i, dimension, dimension, lineup),
+                 dimension, lineup, moves))
+
+    cases = [
+        (name, key) + operations(name, dimension, lineup, moves)
+        for name in options.benchmarks
+        for key, dimension, lineup, moves in games
+    ]
+
+    # Repeats of every case are spread over the whole run, so a slow
+    # period of the machine doesn't spoil all of them. The best one is
+    # taken.
+    speeds = {}
+    for i in range(options.repeat):
+        for name, key, function, ops in cases:
+            speeds.setdefault((name, key), []).append(
+                measure(function, ops, options.min_time))
+
+    results = {}
+    for name, key, function, ops in cases:
+        result = {
+            'ops_per_second': round(max(speeds[name, key])[0], 1),
+            'relative': round(max(i[1] for i in speeds[name, key]), 4)
+        }
+        if tracemalloc is not None:
+            result['peak_bytes_per_op'] = allocated(function, ops)
+        results.setdefault(name, {})[key] = result
+    return {
+        'python': platform.python_version(),
+        'seed': options.seed,
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold):
+    """Return list of the slowdowns: geometric mean of the relative
+    speeds (see `measure`) of the benchmark's games is lower than the
+    baseline's by more than `threshold` (fraction). Single games are too
+    noisy to be compared one by one.
+    """
+    slowdowns = []
+    for name, games in sorted(current['results'].items()):
+        base_games = baseline['results'].get(name, {})
+        keys = [i for i in games if i in base_games]
+        if not keys:
+            continue
+        change = math.exp(sum(
+            math.log(games[i]['relative'] / base_games[i]['relative'])
+            for i in keys) / len(keys))
+        if change < 1 - threshold:
+            worst = min(
+                keys, key=lambda i:
+                games[i]['relative'] / base_games[i]['relative'])
+            slowdowns.append(
+                '{}: {:+.0%} on {} games (worst {}: {:+.0%})'.format(
+                    name, change - 1, len(keys), worst,
+                    games[worst]['relative'] /
+                    base_games[worst]['relative'] - 1))
+    return slowdowns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--min-dimension', type=int, default=3)
+    parser.add_argument('--max-dimension', type=int, default=30)
+    parser.add_argument(
+        '--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--recorded', help='JSON file with recorded games')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--min-time', type=float, default=0.2,
+        help='Minimal time of one repeat in seconds')
+    parser.add_argument('--output', help='Save results to the JSON file')
+    parser.add_argument('--baseline', help='Compare with the saved results')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='Allowed slowdown against the baseline (fraction)')
+    options = parser.parse_args()
+
+    current = run(options)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(current, f, indent=4, sort_keys=True)
+    else:
+        json.dump(current, sys.stdout, indent=4, sort_keys=True)
+        print()
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            slowdowns = compare(current, json.load(f), options.threshold)
+        for line in slowdowns:
+            print(line, file=sys.stderr)
+        sys.exit(1 if slowdowns else 0)
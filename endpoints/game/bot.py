@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Computer opponent: alpha-beta search over `play.Game` boards.
+
+The position is evaluated by all "windows" (`lineup` cells in a row) of
+the board: a window with stones of one color only is a threat of this
+color. Stone counts of the windows are updated incrementally on every
+move, so the evaluation costs O(windows through the cell) per move.
+Search runs in a process pool (see `think`), so it never blocks the
+IOLoop.
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tornado import gen
+
+from play import DIRECTIONS, EMPTY
+import settings
+
+# More than any sum of the window weights.
+WIN = 4 ** 40
+
+executor = None
+
+
+class Timeout(Exception):
+    pass
+
+
+class Position:
+    """Board for the search. Cells use the `play.Game.board` byte values,
+    stone color `c` is stored as `c + 1`.
+    """
+    def __init__(self, board, dimension, lineup):
+        self.dimension = dimension
+        self.lineup = lineup
+        self.cells = bytearray(board)
+        self.weights = [0] + [4 ** i for i in range(1, lineup)] + [WIN]
+
+        # Windows: tuples of cell indexes, and windows of every cell.
+        self.windows = []
+        self.cell_windows = [[] for i in range(dimension * dimension)]
+        for dx, dy in DIRECTIONS:
+            for y in range(dimension):
+                for x in range(dimension):
+                    end_x = x + dx * (lineup - 1)
+                    end_y = y + dy * (lineup - 1)
+                    if not (0 <= end_x < dimension and 0 <= end_y < dimension):
+                        continue
+                    window = len(self.windows)
+                    cells = tuple(
+                        (y + dy * i) * dimension + x + dx * i
+                        for i in range(lineup))
+                    self.windows.append(cells)
+                    for cell in cells:
+                        self.cell_windows[cell].append(window)
+
+        # Stones of every color in every window.
+        self.counts = [[0, 0] for i in self.windows]
+        self.stones = []
+        self.score = [0, 0]
+        for cell, value in enumerate(self.cells):
+            if value != EMPTY:
+                self.cells[cell] = EMPTY
+                self.place(cell, value - 1)
+
+    def gain(self, cell, color):
+        """Evaluation change (for `color`) of the `color` stone in the
+        `cell`: new own threats plus blocked threats of the opponent.
+        """
+        weights, counts = self.weights, self.counts
+        result = 0
+        for window in self.cell_windows[cell]:
+            own, other = counts[window][color], counts[window][1 - color]
+            if not other:
+                result += weights[own + 1] - weights[own]
+            if not own:
+                result += weights[other]
+        return result
+
+    def is_winning(self, cell, color):
+        lineup = self.lineup - 1
+        for window in self.cell_windows[cell]:
+            count = self.counts[window]
+            if count[color] == lineup and not count[1 - color]:
+                return True
+        return False
+
+    def place(self, cell, color):
+        """Put the stone, return True if it wins."""
+        weights, counts = self.weights, self.counts
+        won = False
+        for window in self.cell_windows[cell]:
+            count = counts[window]
+            own, other = count[color], count[1 - color]
+            if not other:
+                self.score[color] += weights[own + 1] - weights[own]
+                won = won or own + 1 == self.lineup
+            elif not own:
+                self.score[1 - color] -= weights[other]
+            count[color] += 1
+        self.cells[cell] = color + 1
+        self.stones.append(cell)
+        return won
+
+    def undo(self, cell, color):
+        weights, counts = self.weights, self.counts
+        for window in self.cell_windows[cell]:
+            count = counts[window]
+            count[color] -= 1
+            own, other = count[color], count[1 - color]
+            if not other:
+                self.score[color] -= weights[own + 1] - weights[own]
+            elif not own:
+                self.score[1 - color] += weights[other]
+        self.cells[cell] = EMPTY
+        self.stones.pop()
+
+    def evaluate(self, color):
+        return self.score[color] - self.score[1 - color]
+
+    def candidates(self, color, branching):
+        """Empty cells next to the stones, best first. If a move wins, it
+        is the only candidate; if the opponent has winning moves, only
+        they are considered (they must be blocked).
+        """
+        d = self.dimension
+        if not self.stones:
+            return [(d // 2) * d + d // 2]
+
+        near = set()
+        for cell in self.stones:
+            y, x = divmod(cell, d)
+            for j in range(max(0, y - 1), min(d, y + 2)):
+                for i in range(max(0, x - 1), min(d, x + 2)):
+                    if self.cells[j * d + i] == EMPTY:
+                        near.add(j * d + i)
+
+        blocks = []
+        for cell in near:
+            if self.is_winning(cell, color):
+                return [cell]
+            if self.is_winning(cell, 1 - color):
+                blocks.append(cell)
+        if blocks:
+            return blocks
+
+        moves = sorted(near, key=lambda cell: -self.gain(cell, color))
+        return moves[:branching]
+
+
+class Search:
+    def __init__(self, position, time_limit, node_limit, branching):
+        self.position = position
+        self.deadline = time.time() + time_limit
+        self.node_limit = node_limit
+        self.branching = branching
+        self.nodes = 0
+
+    def negamax(self, depth, alpha, beta, color):
+        self.nodes += 1
+        if self.nodes >= self.node_limit or \
+                (self.nodes % 256 == 0 and time.time() > self.deadline):
+            raise Timeout()
+
+        position = self.position
+        if depth == 0:
+            return position.evaluate(color)
+
+        moves = position.candidates(color, self.branching)
+        if not moves:
+            return 0
+
+        best = -WIN * 2
+        for cell in moves:
+            if position.place(cell, color):
+                value = WIN + depth
+            else:
+                value = -self.negamax(depth - 1, -beta, -alpha, 1 - color)
+            position.undo(cell, color)
+
+            best = max(best, value)
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+        return best
+
+    def root(self, depth, color, moves):
+        """Return moves sorted by value (best first)."""
+        position = self.position
+        alpha, values = -WIN * 2, {}
+        for cell in moves:
+            if position.place(cell, color):
+                value = WIN + depth
+            else:
+                value = -self.negamax(depth - 1, -WIN * 2, -alpha, 1 - color)
+            position.undo(cell, color)
+            values[cell] = value
+            alpha = max(alpha, value)
+        return sorted(moves, key=lambda cell: -values[cell]), alpha
+
+
+def choose_move(board, dimension, lineup, color, time_limit=None,
+                node_limit=None, branching=None):
+    """Return (x, y, nodes, seconds) of the best found move of the
+    `color` (0 - white, 1 - black). Search deepens iteratively until the
+    time or node limit.
+    """
+    started = time.time()
+    position = Position(board, dimension, lineup)
+    search = Search(
+        position,
+        time_limit or settings.BOT_TIME_LIMIT,
+        node_limit or settings.BOT_NODE_LIMIT,
+        branching or settings.BOT_BRANCHING)
+
+    moves = position.candidates(color, search.branching)
+    depth = 1
+    try:
+        while len(moves) > 1 and depth <= len(position.cells):
+            moves, value = search.root(depth, color, moves)
+            if value >= WIN:
+                break
+            depth += 1
+    except Timeout:
+        pass
+
+    y, x = divmod(moves[0], dimension)
+    return x + 1, y + 1, search.nodes, time.time() - started
+
+
+@gen.coroutine
+def think(game, color):
+    """Choose move for the `play.Game` in the process pool."""
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(settings.BOT_PROCESSES)
+
+    result = yield executor.submit(
+        choose_move, game.to_bytes(), game.dimension, game.lineup, color)
+    return result
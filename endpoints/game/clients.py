@@ -1,10 +1,194 @@
 # -*- coding: utf-8 -*-
 
-from tornado import httpclient
+import logging
+import time
+from urllib.parse import urlparse
+
+from tornado import gen, httpclient, stack_context
 from toredis import Client
+from toredis.commands import RedisCommandsMixin
+
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+import metrics
+import settings
+
+
+class ReconnectingClient(Client):
+    """Redis connection, which reconnects after the loss of connection
+    with exponential backoff.
+    """
+    delay = settings.REDIS_RECONNECT_DELAY
+
+    def connect(self, host='localhost', port=6379, callback=None):
+        self.host, self.port = host, port
+        super().connect(host, port, callback=self._on_connect)
+
+    def _on_connect(self):
+        self.delay = settings.REDIS_RECONNECT_DELAY
+        self.on_connect()
+
+    def on_connect(self):
+        """Called after every (re)connect, override it to restore state
+        of the connection.
+        """
+        pass
+
+    def on_disconnect(self):
+        logging.warning(
+            'Redis connection is lost, reconnect in %s seconds.', self.delay)
+        self._io_loop.add_timeout(
+            time.time() + self.delay, lambda: self.connect(self.host, self.port))
+        self.delay = min(self.delay * 2, settings.REDIS_MAX_RECONNECT_DELAY)
+
+
+class SubscriberClient(ReconnectingClient):
+    """Redis connection in the subscribe mode. All replies go to the
+    subscription callback, so commands don't queue reply callbacks (they
+    would never be called and removed).
+    """
+    def send_message(self, args, callback=None):
+        self._stream.write(self.format_message(args))
+
+
+class PipelinedClient(ReconnectingClient):
+    """Redis connection, which writes all commands sent within one IOLoop
+    iteration at once, so they take one network round trip. Commands sent
+    while disconnected are written after the reconnect (but not more than
+    `REDIS_MAX_PENDING`, others fail at once).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer = []
+
+    def send_message(self, args, callback=None):
+        if not self.is_connected() and \
+                len(self.callbacks) >= settings.REDIS_MAX_PENDING:
+            if callback is not None:
+                callback(ConnectionError('Redis is not connected.'))
+            return
+
+        if callback is not None:
+            callback = stack_context.wrap(callback)
+        self.callbacks.append(callback)
+        self.buffer.append(self.format_message(args))
+        if len(self.buffer) == 1:
+            self._io_loop.add_callback(self.flush)
+
+    def flush(self):
+        if self.buffer and self.is_connected():
+            data, self.buffer = b''.join(self.buffer), []
+            self._stream.write(data)
+
+    def on_connect(self):
+        self.flush()
+
+    def on_disconnect(self):
+        # Callbacks of the unwritten commands are already called with None.
+        self.buffer = []
+        super().on_disconnect()
+
+
+class Pool(RedisCommandsMixin):
+    """Pool of the pipelined redis connections with the interface of one
+    `toredis.Client`. Command goes to the connected connection with the
+    fewest replies to wait for. PUBLISH always goes to the first one, so
+    messages published by the process keep their order.
+
+    Time and errors of the commands are recorded (see `metrics`).
+    """
+    def __init__(self, size):
+        self.connections = [PipelinedClient() for i in range(size)]
+
+    def connect(self, host='localhost', port=6379):
+        for connection in self.connections:
+            connection.connect(host, port)
+
+    def get_connection(self, command):
+        if command == 'PUBLISH':
+            return self.connections[0]
+        connected = [i for i in self.connections if i.is_connected()]
+        return min(
+            connected or self.connections, key=lambda i: len(i.callbacks))
+
+    def send_message(self, args, callback=None, connection=None,
+                     label=None):
+        """Send command. Metrics of the command are recorded by the
+        `label` (the command name by default, the script name for the
+        scripts, see `redis_scripts.RedisScript`).
+        """
+        command = args[0]
+        label = label or command
+        started = time.time()
+
+        def on_reply(reply):
+            metrics.redis_seconds.observe(label, time.time() - started)
+            if isinstance(reply, Exception):
+                metrics.redis_errors.inc(label)
+            if callback is not None:
+                callback(reply)
+
+        connection = connection or self.get_connection(command)
+        connection.send_message(args, on_reply)
+
+    def batch(self, commands, callback=None):
+        """Send list of commands (lists of arguments) at once and in order
+        through one connection. Callback gets list of the replies. Can be
+        used with `gen.Task`:
+
+            replies = yield gen.Task(redis_client.batch, [
+                ['INCR', 'counter'], ['SADD', 'set', 'member']])
+        """
+        connection = self.get_connection(None)
+        replies = [None] * len(commands)
+        waiting = [len(commands)]
+
+        def on_reply(index, reply):
+            replies[index] = reply
+            waiting[0] -= 1
+            if not waiting[0] and callback is not None:
+                callback(replies)
+
+        for index, args in enumerate(commands):
+            self.send_message(
+                args, lambda reply, index=index: on_reply(index, reply),
+                connection)
+
+
+redis_client = Pool(settings.REDIS_POOL_SIZE)
+redis_client.connect(settings.REDIS_HOST, settings.REDIS_PORT)
+
+# Connection in the subscribe mode (see `routing`).
+pubsub_client = SubscriberClient()
+pubsub_client.connect(settings.REDIS_HOST, settings.REDIS_PORT)
 
+# Connections are kept alive only by the curl based client.
+if pycurl is not None:
+    httpclient.AsyncHTTPClient.configure(
+        'tornado.curl_httpclient.CurlAsyncHTTPClient')
+http_client = httpclient.AsyncHTTPClient(
+    max_clients=settings.STATS_MAX_CLIENTS)
 
-redis_client = Client()
-redis_client.connect('localhost')
 
-http_client = httpclient.AsyncHTTPClient()
+@gen.coroutine
+def fetch(request, **kwargs):
+    """`http_client.fetch`, which records time and errors of the request
+    by the URL path.
+    """
+    url = request.url if isinstance(request, httpclient.HTTPRequest) \
+        else request
+    path = urlparse(url).path
+    started = time.time()
+    try:
+        response = yield http_client.fetch(request, **kwargs)
+    except Exception as e:
+        # Not modified answer of the conditional request isn't an error.
+        if getattr(e, 'code', None) != 304:
+            metrics.http_errors.inc(path)
+        raise
+    finally:
+        metrics.http_seconds.observe(path, time.time() - started)
+    return response
@@ -1,48 +1,170 @@
 # -*- coding: utf-8 -*-
 
+import base64
 import json
+import logging
 import re
+import time
+from functools import partial
+
+import tornado.ioloop
 from tornado import gen
 
-from base_connections import BaseConnection
+from base_connections import BaseConnection, broadcast_lobby_removals
 from decorators import expect_json, login_required
-from clients import redis_client, http_client
-from utils import hgetall_group_by
-from play import Game
+from clients import redis_client
+from play import Game, unpack_move
+import leaderboard
+import bot
+import metrics
+import routing
+from redis_scripts import join_script, move_script, resign_script
+import settings
 
 reg = re.compile(r'^[a-zA-Z0-9_.-]+$')
 
 
+def load_game(board, matrix, moves, dimension, lineup=None):
+    """Build game from the board snapshot (redis `board` field) and the
+    moves made after it. Games saved before the binary board have JSON
+    `matrix` field only.
+    """
+    if board is not None:
+        game = Game.from_bytes(board, dimension, lineup)
+    elif matrix is not None:
+        game = Game(json.loads(matrix.decode('utf-8')), dimension, lineup)
+    else:
+        game = Game(None, dimension, lineup)
+
+    game.apply_moves(moves)
+    return game
+
+
+def encode_bitmaps(game):
+    """Return compact snapshot of the board: base64 encoded `black` and
+    `white` bitmaps (see `Game.bitmaps`).
+    """
+    black, white = game.bitmaps()
+    return {
+        'black': base64.b64encode(black).decode('ascii'),
+        'white': base64.b64encode(white).decode('ascii')
+    }
+
+
 class UsernameChoiceConnection(BaseConnection):
     """Channel connection. Used for managing users."""
     @expect_json
     @gen.coroutine
     def on_message(self, message):
-        username = message.get('username')
+        """Message is JSON with `username` to log in, or with `token` to
+        resume the disconnected session (optionally with `game_id` and
+        `seq` of the last received move of the game).
+        """
+        if 'token' in message:
+            yield self.resume(message)
+            return
 
-        is_member = yield gen.Task(
-            redis_client.sismember, "players:all", username)
+        username = message.get('username')
 
-        if reg.match(username) and not is_member:
-            # Logging in.
-            yield self.create_player(username)
+        created = False
+        if reg.match(username):
+            # Logging in, the name is checked and taken by one script.
+            created = yield self.create_player(username)
 
+        if created:
             answer = {
                 'status': 'ok',
                 'username': self.username,
-                'user_id': self.user_id
+                'user_id': self.user_id,
+                'token': self.token
             }
             self.send(json.dumps(answer))
         else:
             self.send_error('Bad username or someone already has this one.')
 
+    @gen.coroutine
+    def resume(self, message):
+        errors = []
+
+        try:
+            game_id = message.get('game_id')
+            seq = int(message.get('seq') or 0)
+        except (TypeError, ValueError):
+            errors.append('Wrong query for the resume.')
+
+        if not errors:
+            resumed = yield self.resume_player(message['token'])
+            if not resumed:
+                errors.append('Session is expired.')
+
+        if not errors:
+            self.send(json.dumps({
+                'status': 'ok',
+                'username': self.username,
+                'user_id': self.user_id,
+                'token': self.token,
+                'resumed': True
+            }))
+            if game_id is not None:
+                yield self.send_missed(game_id, seq)
+        else:
+            self.send_error(errors)
+
+    @gen.coroutine
+    def send_missed(self, game_id, seq):
+        """Send moves of the game made after the `seq` move (or the end of
+        the game) to the resumed player.
+        """
+        raw_data = yield gen.Task(
+            redis_client.hmget, 'games:id:{}'.format(game_id),
+            ['creator', 'opponent', 'turn'])
+
+        if raw_data[0] is None:
+            result = yield gen.Task(
+                redis_client.get, 'games:result:{}'.format(game_id))
+            if result is not None:
+                result = json.loads(result.decode('utf-8'))
+                if self.username in result['players']:
+                    winner = result['winner']
+                    rank = yield leaderboard.get_rank(self.username)
+                    self.send_channel('game_finish', json.dumps({
+                        'winner': winner and winner == self.username,
+                        'rank': rank
+                    }))
+            return
+
+        players = [i and i.decode('utf-8') for i in raw_data]
+        if self.username not in players[:2]:
+            return
+
+        moves = yield gen.Task(
+            redis_client.lrange, 'games:moves:{}'.format(game_id), seq, -1)
+        for i, data in enumerate(moves):
+            x, y, color = unpack_move(data)
+            self.send_channel('game_action', json.dumps({
+                'status': 'ok',
+                'seq': seq + i + 1,
+                'action': {
+                    'x': x,
+                    'y': y,
+                    'color': 'black' if color else 'white'
+                }
+            }))
+
+        if players[1] is None:
+            msg = 'Waiting for the opponent...'
+        elif players[2] == self.username:
+            msg = "Now it's your turn."
+        else:
+            msg = "Now it's a {}'s turn. Waiting...".format(players[2])
+        self.send_channel('note', json.dumps({'msg': msg}))
+
 
 class StatsConnection(BaseConnection):
     @gen.coroutine
     def on_open(self, info):
-        url = 'http://localhost:8000/api/player/top'
-        response = yield http_client.fetch(url, method="GET")
-        self.send(response.body.decode('utf-8'))
+        top = yield leaderboard.get_top()
+        self.send(top)
         super().on_open(info)
 
 
@@ -56,8 +178,38 @@ class GamesListConnection(BaseConnection):
     @login_required
     @gen.coroutine
     def on_message(self, message):
-        games = yield self.get_games()
-        self.send(games)
+        """Message is empty (first page of all games) or JSON with
+        optional offset, limit and filters (color, dimension, lineup).
+        """
+        errors = []
+        filters = {}
+
+        try:
+            query = json.loads(message) if message else {}
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', settings.LOBBY_PAGE_SIZE))
+            for name in ['dimension', 'lineup']:
+                if query.get(name) is not None:
+                    filters[name] = int(query[name])
+            filters['color'] = query.get('color')
+        except (ValueError, TypeError, AttributeError):
+            errors.append('Wrong query for the list of games.')
+
+        if not errors and offset < 0:
+            errors.append('Offset must be positive.')
+
+        if not errors and not (1 <= limit <= settings.LOBBY_MAX_LIMIT):
+            errors.append('Limit must be from 1 to {}.'.format(
+                settings.LOBBY_MAX_LIMIT))
+
+        if not errors and filters['color'] not in [None, 'black', 'white']:
+            errors.append('Color must be "black" or "white".')
+
+        if not errors:
+            games = yield self.get_games(offset, limit, filters)
+            self.send(games)
+        else:
+            self.send_error(errors)
 
 
 class GamesJoinConnection(BaseConnection):
@@ -65,81 +217,273 @@ class GamesJoinConnection(BaseConnection):
     @login_required
     @gen.coroutine
     def on_message(self, message):
-        errors = []
+        """Message is JSON with `game_id`. Clients with `compact` flag get
+        the board as bitmaps (see `encode_bitmaps`) instead of the list of
+        cells.
+        """
         game_id = message.get('game_id')
 
+        # Checks, the join and the removal from the lobby are made by one
+        # script.
         raw_data = yield gen.Task(
-            redis_client.hmget, 'games:id:{}'.format(game_id),
-            ['dimension', 'matrix', 'creator', 'opponent', 'color', 'lineup']
-        )
+            join_script,
+            ['games:id:{}'.format(game_id), 'games:moves:{}'.format(game_id),
+             'games:activity'],
+            [self.username, settings.GAME_TTL, int(time.time()), game_id])
+
+        if raw_data[0] == b'error':
+            self.send_error([raw_data[1].decode('utf-8')])
+            return
+
+        creator = raw_data[1].decode('utf-8')
+        dimension = int(raw_data[2])
+        color = raw_data[3].decode('utf-8')
+        game = load_game(raw_data[4], raw_data[5], raw_data[6], dimension)
+        opponent = self.username
+
+        if message.get('compact'):
+            game = dict(
+                game_id=game_id, dimension=dimension, **encode_bitmaps(game))
+        else:
+            game = {
+                'game_id': game_id,
+                'dimension': dimension,
+                'cells': game.serialize_cells()
+            }
 
-        if raw_data[0] is None:
-            errors.append('Wrong game id.')
+        self.send(json.dumps({
+            'status': 'ok',
+            'game': game
+        }))
+        broadcast_lobby_removals([[game_id, raw_data[7]]])
 
-        if not errors:
-            dimension = int(raw_data[0])
-            matrix = json.loads(raw_data[1].decode('utf-8'))
-            creator = raw_data[2].decode('utf-8')
-            opponent = raw_data[3] and raw_data[3].decode('utf-8')
-            color = raw_data[4].decode('utf-8')
-            lineup = raw_data[5].decode('utf-8')
+        if color == 'black':
+            opponent_msg = 'You stone is white.'
+            creator_msg = 'You stone is black, and now your turn.'
+        else:
+            creator_msg = 'You stone is white.'
+            opponent_msg = 'You stone is black, and now your turn.'
 
-            if opponent is not None:
-                print(opponent, game_id, raw_data)
-                errors.append('Game is already started.')
+        self.send_channel(
+            'note',
+            json.dumps({'msg': 'Welcome to the game #{}. {}'.format(
+                game_id, opponent_msg)}))
+        self.get_player(creator).send_channel(
+            'note',
+            json.dumps({'msg': 'Joining new user "{}". {}'.format(
+                opponent, creator_msg)}))
 
-            if self.username == creator:
-                errors.append("You can't play with youself.")
+
+class GameConnection(BaseConnection):
+    """Base connection for the game channels, which make moves."""
+
+    @gen.coroutine
+    def make_move(self, game_id, username, x, y):
+        """Commit move of the player and notify players about it (and
+        about the end of the game). Return list of errors, game, player
+        to move and status of the game.
+        """
+        errors = []
+        game = turn = status = None
+
+        # Turn check, occupancy check, stone placement, turn flip and
+        # the end of the game are done atomically on the redis side.
+        raw_data = yield gen.Task(
+            move_script,
+            ['games:id:{}'.format(game_id),
+             'games:moves:{}'.format(game_id), 'games:activity'],
+            [username, x, y, settings.SNAPSHOT_INTERVAL, settings.GAME_TTL,
+             int(time.time()), game_id]
+        )
+        if raw_data[0] == b'error':
+            errors.append(raw_data[1].decode('utf-8'))
 
         if not errors:
-            opponent = self.username
-            data_to_save = {'opponent': opponent}
+            creator, opponent = [i.decode('utf-8') for i in raw_data[1:3]]
+            dimension = int(raw_data[3])
+            lineup = int(raw_data[4])
+            color, turn = [i.decode('utf-8') for i in raw_data[5:7]]
 
-            game = {
-                'game_id': game_id,
-                'dimension': dimension,
-                'cells': Game(matrix, dimension).serialize_cells()
-            }
+            if username == creator:
+                action_color = color
+            else:
+                action_color = 'white' if color == 'black' else 'black'
 
-            self.send(json.dumps({
+            color_dict = {
+                'white': 0,
+                'black': 1
+            }
+            game = load_game(raw_data[7], None, raw_data[8], dimension, lineup)
+            # Status of the game comes from the script only.
+            game.set_cell(x, y, color_dict[action_color])
+            game.moves += 1
+            if len(raw_data) > 9:
+                status = raw_data[9].decode('utf-8')
+                moves = raw_data[10]
+
+            routing.publish('games:watch:{}'.format(game_id), json.dumps({
                 'status': 'ok',
-                'game': game
+                'seq': game.moves,
+                'action': {
+                    'x': x,
+                    'y': y,
+                    'color': action_color
+                }
             }))
 
-            if color == 'black':
-                data_to_save.update({'turn': creator})
-                opponent_msg = 'You stone is white.'
-                creator_msg = 'You stone is black, and now your turn.'
-            else:
-                data_to_save.update({'turn': opponent})
-                creator_msg = 'You stone is white.'
-                opponent_msg = 'You stone is black, and now your turn.'
+            players = [
+                i for i in [opponent, creator] if i != settings.BOT_USERNAME]
 
-            yield gen.Task(
-                redis_client.hmset, 'games:id:{}'.format(game_id),
-                data_to_save)
+            for player_name in players:
+                player = self.get_player(player_name)
+                player.send_channel(
+                    'game_action',
+                    json.dumps({
+                        'status': 'ok',
+                        'seq': game.moves,
+                        'action': {
+                            'x': x,
+                            'y': y,
+                            'color': action_color
+                        }
+                    })
+                )
 
-            title = '{0} ({1}x{1}, {2} in row) [{3}]'.format(
-                creator, dimension, lineup, color)
-            yield gen.Task(
-                redis_client.srem, 'games:all',
-                '{}:{}'.format(game_id, title))
-            games = yield self.get_games()
-            self.broadcast_all_channel("games_list", games)
-
-            self.send_channel(
-                'note',
-                json.dumps({'msg': 'Welcome to the game #{}. {}'.format(
-                    game_id, opponent_msg)}))
-            self.get_player(creator).send_channel(
-                'note',
-                json.dumps({'msg': 'Joining new user "{}". {}'.format(
-                    opponent, creator_msg)}))
+                if status is not None:
+                    continue
+                if turn == player_name:
+                    msg = "Now it's your turn."
+                else:
+                    msg = "Now it's a {}'s turn. Waiting...".format(
+                        opponent if player_name == creator else creator)
+                player.send_channel('note', json.dumps({'msg': msg}))
+
+        if status is not None:
+            yield self.finish_game(
+                game_id, creator, opponent, dimension, lineup, color,
+                None if status == 'draw' else username, moves, game.moves)
+
+        return errors, game, turn, status
+
+    @gen.coroutine
+    def finish_game(self, game_id, creator, opponent, dimension, lineup,
+                    color, winner, moves, seq):
+        """Queue the round of the deleted game, update the leaderboard and
+        notify players and watchers. `winner` is None for draw, `moves`
+        are all packed moves, `seq` is the number of moves.
+        """
+        round_data = {
+            'creator': creator,
+            'opponent': opponent,
+            'dimension': dimension,
+            'lineup': lineup,
+            'lead': creator if color == 'black' else opponent,
+            'winner': winner
+        }
+        # Games started before the moves list have partial history.
+        if len(moves) == seq:
+            round_data['moves'] = [list(unpack_move(i)[:2]) for i in moves]
+
+        routing.publish('games:watch:{}'.format(game_id), json.dumps({
+            'status': 'ok',
+            'seq': seq,
+            'finish': {'winner': winner}
+        }))
+
+        players = [
+            i for i in [opponent, creator] if i != settings.BOT_USERNAME]
+        yield [
+            gen.Task(redis_client.batch, [
+                # Rounds are saved by the stats server's `drain_rounds`
+                # worker.
+                ['LPUSH', settings.ROUNDS_QUEUE, json.dumps(round_data)],
+                # Result for the players, who resume the session later.
+                ['SET', 'games:result:{}'.format(game_id), json.dumps({
+                    'players': [creator, opponent],
+                    'winner': winner
+                }), 'EX', settings.RESUME_GRACE * 2]
+            ]),
+            leaderboard.record_round(creator, opponent, winner)
+        ]
+        results = yield [leaderboard.get_top()] + [
+            leaderboard.get_rank(i) for i in players
+        ]
+        self.broadcast_all_channel('stats', results[0])
+
+        for player_name, rank in zip(players, results[1:]):
+            self.get_player(player_name).send_channel(
+                'game_finish', json.dumps({
+                    'winner': winner and winner == player_name,
+                    'rank': rank
+                }))
+
+    @gen.coroutine
+    def resign(self, game_id, username, seq):
+        """Finish the game with the win of the opponent of `username`.
+        Return list of errors.
+        """
+        raw_data = yield gen.Task(
+            resign_script,
+            ['games:id:{}'.format(game_id),
+             'games:moves:{}'.format(game_id), 'games:activity'],
+            [username, game_id])
+        if raw_data[0] == b'error':
+            return [raw_data[1].decode('utf-8')]
+
+        creator, opponent = [i.decode('utf-8') for i in raw_data[1:3]]
+        yield self.finish_game(
+            game_id, creator, opponent, int(raw_data[3]), int(raw_data[4]),
+            raw_data[5].decode('utf-8'),
+            opponent if username == creator else creator, raw_data[6], seq)
+        return []
+
+    def start_bot_move(self, game_id, game):
+        """Start the bot turn apart from the message handling, so time of
+        the handler doesn't include the search. Time of the turn is
+        recorded by `metrics.bot_seconds`.
+        """
+        started = time.time()
+
+        def on_done(future):
+            metrics.bot_seconds.observe('turn', time.time() - started)
+            future.result()
+
+        tornado.ioloop.IOLoop.instance().add_future(
+            self.bot_move(game_id, game), on_done)
+
+    @gen.coroutine
+    def bot_move(self, game_id, game):
+        """Make move of the computer opponent. Black moves first, so the
+        color of the bot is known from the number of moves.
+        """
+        color, seq = (game.moves + 1) % 2, game.moves
+        try:
+            x, y, nodes, seconds = yield bot.think(game, color)
+            metrics.bot_seconds.observe('search', seconds)
+            speed = int(nodes / seconds) if seconds else nodes
+            logging.info(
+                'Bot move in the game #%s: %s nodes, %.3f s, %s nodes/s.',
+                game_id, nodes, seconds, speed)
+
+            errors, game, turn, status = yield self.make_move(
+                game_id, settings.BOT_USERNAME, x, y)
+            if not errors:
+                return
+            logging.error(
+                'Bot move in the game #%s failed: %s', game_id, errors)
+        except Exception:
+            logging.exception('Bot move in the game #%s failed.', game_id)
+
+        # Otherwise the game waits for the bot till it expires.
+        errors = yield self.resign(game_id, settings.BOT_USERNAME, seq)
+        if errors:
+            logging.error(
+                'Bot resignation in the game #%s failed: %s', game_id, errors)
         else:
-            self.send_error(errors)
+            self.send_channel('note', json.dumps({'msg': 'Bot resigns.'}))
 
 
-class GameCreateConnection(BaseConnection):
+class GameCreateConnection(GameConnection):
     @expect_json
     @login_required
     @gen.coroutine
@@ -167,6 +511,10 @@ class GameCreateConnection(BaseConnection):
         if not errors and lineup > dimension:
             errors.append('Lineup must be less than dimension.')
 
+        opponent = message.get('opponent', 'human')
+        if not errors and opponent not in ['human', 'bot']:
+            errors.append('Opponent must be "human" or "bot".')
+
         if not errors:
             raw_data = yield gen.Task(redis_client.incr, 'games:counter')
             game_id = int(raw_data)
@@ -178,15 +526,34 @@ class GameCreateConnection(BaseConnection):
                 'creator': self.username,
                 'dimension': dimension,
                 'lineup': lineup,
-                'color': color,
-                'matrix': []
+                'color': color
             }
-
-            yield gen.Task(
-                redis_client.hmset, 'games:id:{}'.format(game_id), data)
-            yield gen.Task(
-                redis_client.sadd, 'games:all',
-                '{}:{}'.format(game_id, title))
+            if opponent == 'bot':
+                data.update({
+                    'opponent': settings.BOT_USERNAME,
+                    'turn': self.username if color == 'black'
+                    else settings.BOT_USERNAME
+                })
+
+            # The game is saved by one batch (the moves list doesn't exist
+            # yet), the lobby is changed at the same time.
+            saved = gen.Task(redis_client.batch, [
+                ['HMSET', 'games:id:{}'.format(game_id)] +
+                [i for item in data.items() for i in item],
+                ['EXPIRE', 'games:id:{}'.format(game_id), settings.GAME_TTL],
+                ['ZADD', 'games:activity', int(time.time()), game_id]
+            ])
+            if opponent == 'bot':
+                yield saved
+            else:
+                yield [saved, self.change_games({
+                    'game_id': game_id,
+                    'title': title,
+                    'creator': self.username,
+                    'dimension': dimension,
+                    'lineup': lineup,
+                    'color': color
+                }, added=True)]
 
             game = {
                 'game_id': game_id,
@@ -199,18 +566,22 @@ class GameCreateConnection(BaseConnection):
                 'game': game
             }))
 
-            games = yield self.get_games()
-            self.broadcast_all_channel("games_list", games)
-
-            self.send_channel(
-                'note',
-                json.dumps({'msg': 'Waiting for the opponent...'})
-            )
+            if opponent == 'bot':
+                if color == 'black':
+                    self.send_channel('note', json.dumps(
+                        {'msg': 'You stone is black, and now your turn.'}))
+                else:
+                    self.start_bot_move(game_id, Game(None, dimension, lineup))
+            else:
+                self.send_channel(
+                    'note',
+                    json.dumps({'msg': 'Waiting for the opponent...'})
+                )
         else:
             self.send_error(errors)
 
 
-class GameActionConnection(BaseConnection):
+class GameActionConnection(GameConnection):
     @expect_json
     @login_required
     @gen.coroutine
@@ -218,121 +589,140 @@ class GameActionConnection(BaseConnection):
         errors = []
         game_id = message.get('game_id')
 
-        raw_data = yield gen.Task(
-            redis_client.hgetall, 'games:id:{}'.format(game_id)
-        )
-        if not raw_data:
-            errors.append('This game not existed or already finished.')
+        try:
+            x, y = int(message['x']), int(message['y'])
+        except (KeyError, TypeError, ValueError):
+            errors.append('Bad action.')
 
         if not errors:
-            data = hgetall_group_by(raw_data)
+            errors, game, turn, status = yield self.make_move(
+                game_id, self.username, x, y)
 
-        if not errors and 'opponent' not in data:
-            errors.append('Need opponent to join to the game.')
+        if errors:
+            self.send_error(errors)
+        elif status is None and turn == settings.BOT_USERNAME:
+            self.start_bot_move(game_id, game)
 
-        if not errors:
-            creator = data['creator']
-            opponent = data['opponent']
-            dimension = int(data['dimension'])
-            lineup = int(data['lineup'])
-            color = data['color']
-            turn = data['turn']
-            matrix = json.loads(data['matrix'])
 
-        if not errors and self.username not in [creator, opponent]:
-            errors.append("You are not participant of this game.")
+class GameFinishConnection(BaseConnection):
+    pass
 
-        if not errors and self.username != turn:
-            errors.append(
-                "It's not your turn. Please, wait for your opponent's move.")
 
-        if not errors:
-            game = Game(matrix, dimension, lineup)
+def deliver_watch(game_id, data):
+    """Send move (or the end) of the game published by `make_move` to all
+    watchers of the game on the current server. The message is encoded
+    once for all watchers.
+    """
+    targets = GameWatchConnection.watchers.get(game_id)
+    if not targets:
+        return
+
+    message = json.loads(data)
+    ready = []
+    for watcher in targets:
+        if watcher.pending is None:
+            ready.append(watcher)
+        else:
+            watcher.pending.append((message, data))
+    if ready:
+        ready[0].broadcast_channel('game_watch', ready, data)
+
+    if 'finish' in message:
+        for watcher in list(targets):
+            if watcher.pending is None:
+                watcher.unwatch()
+
+
+class GameWatchConnection(BaseConnection):
+    """Channel connection. Used for watching games: the board snapshot is
+    sent once, then only new moves (see `deliver_watch`). Every move has
+    `seq` (number of stones on the board), clients ask for the snapshot
+    again if some moves were missed.
+    """
+    # Watchers by game id.
+    watchers = {}
+    game_id = None
+    # Moves received while the snapshot is loaded (None after it).
+    pending = None
 
-            if self.username == creator:
-                action_color = color
-            else:
-                action_color = 'white' if color == 'black' else 'black'
+    @expect_json
+    @gen.coroutine
+    def on_message(self, message):
+        """Message is JSON with `game_id` to watch (or null to stop)."""
+        errors = []
 
-            color_dict = {
-                'white': 0,
-                'black': 1
-            }
-            action, status = game.action(
-                message['x'], message['y'], color_dict[action_color])
-            if not action:
-                errors.append('Bad action.')
+        if message.get('game_id') is None:
+            self.unwatch()
+            return
 
-        if not errors:
-            turn = opponent if turn == creator else creator
-            yield gen.Task(
-                redis_client.hset, 'games:id:{}'.format(game_id),
-                'turn', turn)
-            yield gen.Task(
-                redis_client.hset, 'games:id:{}'.format(game_id),
-                'matrix', json.dumps(game.matrix))
+        try:
+            game_id = int(message.get('game_id'))
+        except (TypeError, ValueError):
+            errors.append('Wrong game id.')
 
         if not errors:
-            for username in [opponent, creator]:
-                player = self.get_player(username)
-                player.send_channel(
-                    'game_action',
-                    json.dumps({
-                        'status': 'ok',
-                        'action': {
-                            'x': message['x'],
-                            'y': message['y'],
-                            'color': action_color
-                        }
-                    })
-                )
-
-                if turn == username:
-                    msg = "Now it's your turn."
-                else:
-                    msg = "Now it's a {}'s turn. Waiting...".format(
-                        opponent if username == creator else creator)
-                player.send_channel('note', json.dumps({'msg': msg}))
-        else:
-            self.send_error(errors)
-
-        if status is not None:
+            self.watch(game_id)
             raw_data = yield gen.Task(
-                redis_client.delete, 'games:id:{}'.format(game_id)
+                redis_client.hmget, 'games:id:{}'.format(game_id),
+                ['dimension', 'lineup', 'board', 'matrix', 'snapshot']
             )
+            # Another game was asked to watch meanwhile.
+            if self.game_id != game_id:
+                return
+            if raw_data[0] is None:
+                errors.append('Wrong game id.')
 
-            url = 'http://localhost:8000/api/round/save'
-
-            post_data = {
-                'creator': creator,
-                'opponent': opponent,
-                'dimension': dimension,
-                'lineup': lineup,
-                'lead': creator if color == 'black' else opponent,
-                'winner': None if status == 'draw' else self.username
-            }
-
-            headers = {
-                'Content-Type': 'application/json'
-            }
-
-            yield http_client.fetch(
-                url, method="POST", headers=headers, body=json.dumps(post_data))
+        if not errors:
+            dimension = int(raw_data[0])
+            moves = yield gen.Task(
+                redis_client.lrange, 'games:moves:{}'.format(game_id),
+                int(raw_data[4] or 0), -1)
+            game = load_game(
+                raw_data[2], raw_data[3], moves, dimension, int(raw_data[1]))
 
-            url = 'http://localhost:8000/api/player/top'
-            response = yield http_client.fetch(url, method="GET")
-            self.broadcast_all_channel('stats', response.body.decode('utf-8'))
+            if self.game_id != game_id:
+                return
 
-            for username in [opponent, creator]:
-                player = self.get_player(username)
-                if status == 'draw':
-                    winner = None
-                else:
-                    winner = self.username == username
-                player.send_channel(
-                    'game_finish', json.dumps({'winner': winner})
-                )
+            self.send(json.dumps({
+                'status': 'ok',
+                'game': dict(
+                    game_id=game_id, dimension=dimension, seq=game.moves,
+                    **encode_bitmaps(game))
+            }))
 
+            pending, self.pending = self.pending, None
+            for message, data in pending:
+                if message['seq'] > game.moves or 'finish' in message:
+                    self.send(data)
+                if 'finish' in message:
+                    self.unwatch()
+        else:
+            self.unwatch()
+            self.send_error(errors)
 
-class GameFinishConnection(BaseConnection):
-    pass
+    def watch(self, game_id):
+        self.unwatch()
+        self.game_id = game_id
+        self.pending = []
+
+        if game_id not in self.watchers:
+            self.watchers[game_id] = set()
+            routing.subscribe(
+                'games:watch:{}'.format(game_id),
+                partial(deliver_watch, game_id))
+        self.watchers[game_id].add(self)
+
+    def unwatch(self):
+        if self.game_id is None:
+            return
+
+        targets = self.watchers.get(self.game_id, set())
+        targets.discard(self)
+        if not targets:
+            self.watchers.pop(self.game_id, None)
+            routing.unsubscribe('games:watch:{}'.format(self.game_id))
+        self.game_id = self.pending = None
+
+    def on_close(self):
+        self.unwatch()
+        return super().on_close()
@@ -4,9 +4,13 @@ import json
 from functools import wraps
 from tornado import gen
 
+from metrics import timed
+
 
 def expect_json(method):
     """Method decorator, which expects JSON like a income message."""
+    method = getattr(method, 'untimed', method)
+
     @wraps(method)
     @gen.coroutine
     def new_method(self, raw_message):
@@ -16,11 +20,13 @@ def expect_json(method):
         except ValueError:
             self.send_error('Bad JSON message.')
 
-    return new_method
+    return timed(new_method)
 
 
 def login_required(method):
     """Method decorator, which check is player logged on or not."""
+    method = getattr(method, 'untimed', method)
+
     @wraps(method)
     @gen.coroutine
     def new_method(self, message):
@@ -29,4 +35,4 @@ def login_required(method):
         else:
             self.send_error('You must log in.')
 
-    return new_method
+    return timed(new_method)
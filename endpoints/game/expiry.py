@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Expiry of the idle games and of the players of the crashed servers.
+
+Keys of the game expire after `GAME_TTL` seconds without moves, keys of
+the player expire after `PLAYER_TTL` seconds without heartbeats of the
+player's server. Sets and sorted sets (`players:all`, lobby indexes)
+can't expire by members, so the sweeper (one process at a time) removes
+their stale members and broadcasts the lobby changes.
+
+Players and lobby games saved before the expiry are added to the
+indexes once (see `backfill`), so are the open games of the old
+`games:all` set.
+"""
+
+import json
+import logging
+import time
+
+import tornado.ioloop
+from tornado import gen
+
+from base_connections import (
+    BaseConnection, change_lobby, broadcast_lobby_removals)
+from clients import redis_client
+import leaderboard
+from redis_scripts import (
+    heartbeat_script, sweep_players_script, sweep_games_script,
+    backfill_script)
+import settings
+
+
+@gen.coroutine
+def heartbeat():
+    """Refresh TTL of the players of the current server (including the
+    disconnected ones, who may resume the session).
+    """
+    usernames = list(BaseConnection.players)
+    now = int(time.time())
+    for i in range(0, len(usernames), settings.SWEEP_BATCH):
+        yield gen.Task(
+            heartbeat_script, ['players:seen'],
+            [settings.PLAYER_TTL, now] +
+            usernames[i:i + settings.SWEEP_BATCH])
+
+
+@gen.coroutine
+def migrate_games_all():
+    """Move open games of the old `games:all` set (of the "<id>:<title>"
+    strings) to the lobby indexes. Games, which are already joined or
+    gone, are skipped.
+    """
+    entries = yield gen.Task(redis_client.smembers, 'games:all')
+    for entry in entries:
+        game_id, title = entry.decode('utf-8').split(':', 1)
+        raw_data = yield gen.Task(
+            redis_client.hmget, 'games:id:{}'.format(game_id),
+            ['creator', 'opponent', 'dimension', 'lineup', 'color'])
+        if raw_data[0] is None or raw_data[1] is not None:
+            continue
+
+        yield change_lobby({
+            'game_id': int(game_id),
+            'title': title,
+            'creator': raw_data[0].decode('utf-8'),
+            'dimension': int(raw_data[2]),
+            'lineup': int(raw_data[3]),
+            'color': raw_data[4].decode('utf-8')
+        }, added=True)
+
+
+@gen.coroutine
+def reindex_lobby(game_ids):
+    """Save index keys (and the creator) of the lobby games added before
+    they were saved, so scripts can remove them (see
+    `redis_scripts.REMOVE_FROM_LOBBY`). Deleted games are removed.
+    """
+    for i in range(0, len(game_ids), settings.SWEEP_BATCH):
+        batch = game_ids[i:i + settings.SWEEP_BATCH]
+        keys = yield gen.Task(redis_client.hmget, 'games:lobby:keys', batch)
+        for game_id, saved in zip(batch, keys):
+            if saved is not None:
+                continue
+            raw_data = yield gen.Task(redis_client.batch, [
+                ['HGET', 'games:lobby:games', game_id],
+                ['HGET', 'games:id:{}'.format(game_id), 'creator']
+            ])
+            game = json.loads(raw_data[0].decode('utf-8'))
+            if raw_data[1] is None:
+                yield change_lobby(dict(game, creator=''), added=False)
+            else:
+                game['creator'] = raw_data[1].decode('utf-8')
+                yield change_lobby(game, added=True, broadcast=False)
+
+
+@gen.coroutine
+def backfill():
+    """Add players and lobby games saved before the expiry to its indexes,
+    move games of the `games:all` set to the lobby and delete the set,
+    save index keys of the lobby games (see `reindex_lobby`).
+    Only one process does it once, thanks to the `sweeper:backfilled`
+    flag. Players get zero heartbeat time, so they are removed by the next
+    sweeps, games get the current activity time.
+    """
+    is_set = yield gen.Task(
+        redis_client.send_message, ['SET', 'sweeper:backfilled', 1, 'NX'])
+    if is_set is None:
+        return
+
+    try:
+        yield migrate_games_all()
+        usernames = yield gen.Task(redis_client.smembers, 'players:all')
+        game_ids = yield gen.Task(redis_client.hkeys, 'games:lobby:games')
+        yield reindex_lobby([i.decode('utf-8') for i in game_ids])
+        indexes = [
+            ('players:seen', 'players:all', 'SISMEMBER', 0, usernames),
+            ('games:activity', 'games:lobby:games', 'HEXISTS',
+             int(time.time()), game_ids)
+        ]
+        for index, key, check, score, members in indexes:
+            members = [i.decode('utf-8') for i in members]
+            for i in range(0, len(members), settings.SWEEP_BATCH):
+                yield gen.Task(
+                    backfill_script, [index, key],
+                    [check, score] + members[i:i + settings.SWEEP_BATCH])
+        yield gen.Task(redis_client.delete, 'games:all')
+    except Exception:
+        yield gen.Task(redis_client.delete, 'sweeper:backfilled')
+        raise
+
+
+@gen.coroutine
+def sweep():
+    """Remove stale players and games, if no other server does it now."""
+    is_set = yield gen.Task(
+        redis_client.send_message,
+        ['SET', 'sweeper:lock', 1, 'NX', 'EX', settings.SWEEP_INTERVAL])
+    if is_set is None:
+        return
+
+    yield backfill()
+    now = int(time.time())
+    # Lobby entries are removed by the scripts, only the changes are
+    # broadcast here.
+    players, open_games = yield gen.Task(
+        sweep_players_script, ['players:seen', 'players:all'],
+        [now - settings.PLAYER_TTL, settings.SWEEP_BATCH])
+    broadcast_lobby_removals(open_games)
+
+    games = yield gen.Task(
+        sweep_games_script, ['games:activity'],
+        [now - settings.GAME_TTL, settings.SWEEP_BATCH])
+    broadcast_lobby_removals(games)
+
+    if players or games:
+        logging.info(
+            'Sweeper removed %s players and %s games.',
+            players, len(open_games) + len(games))
+
+
+@gen.coroutine
+def tick():
+    try:
+        yield heartbeat()
+        yield sweep()
+        # Retry of the failed filling of the leaderboard.
+        yield leaderboard.seed()
+    except Exception:
+        logging.exception('Expiry failed.')
+
+
+def start():
+    tornado.ioloop.PeriodicCallback(
+        tick, settings.SWEEP_INTERVAL * 1000).start()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Leaderboard of the players kept in redis sorted sets (wins, losses and
+draws by username). The stats server's database stays the durable record,
+the leaderboard is filled from it when redis has no leaderboard yet.
+"""
+
+import json
+import logging
+import time
+
+from tornado import gen
+
+from clients import redis_client
+from redis_scripts import record_round_script, top_script, seed_script
+import settings
+import stats_client
+
+KEYS = ['stats:wins', 'stats:losses', 'stats:draws']
+
+# Time of the next attempt to fill the leaderboard by the current process
+# and the delay after the next failure.
+seed_retry = {'time': 0, 'delay': settings.STATS_SEED_RETRY_DELAY}
+
+
+@gen.coroutine
+def seed():
+    """Fill the leaderboard from the stats server, if it isn't filled yet.
+    Only one process does it at a time, thanks to the `stats:seeded` flag
+    (it expires, if the process dies while loading). Called at the start
+    and by every expiry tick, so failed attempts are retried with backoff.
+
+    Rounds finished while the seed is loaded are already in the
+    leaderboard, so only the players, who aren't there, are added.
+    """
+    if time.time() < seed_retry['time']:
+        return
+
+    is_set = yield gen.Task(
+        redis_client.send_message,
+        ['SET', 'stats:seeded', 'loading', 'NX', 'EX',
+         settings.STATS_SEED_TIMEOUT])
+    if is_set is None:
+        return
+
+    try:
+        top = yield stats_client.get(
+            'player/top', count=settings.STATS_SEED_COUNT)
+        for i in range(0, len(top), settings.STATS_SEED_BATCH):
+            args = []
+            for player in top[i:i + settings.STATS_SEED_BATCH]:
+                args.extend([
+                    player['player'], player['wins'], player['losses'],
+                    player['draws']])
+            yield gen.Task(seed_script, KEYS, args)
+    except Exception:
+        logging.exception(
+            'Leaderboard is not filled from the stats server, retry in %s '
+            'seconds.', seed_retry['delay'])
+        yield gen.Task(redis_client.delete, 'stats:seeded')
+        seed_retry['time'] = time.time() + seed_retry['delay']
+        seed_retry['delay'] = min(
+            seed_retry['delay'] * 2, settings.STATS_SEED_MAX_RETRY_DELAY)
+        return
+
+    yield gen.Task(redis_client.set, 'stats:seeded', 'done')
+
+
+@gen.coroutine
+def record_round(creator, opponent, winner):
+    """Add result of the finished round. `winner` is None for draw."""
+    yield gen.Task(
+        record_round_script, KEYS, [creator, opponent, winner or ''])
+
+
+@gen.coroutine
+def get_top(count=None):
+    """Return serialized top of the players (the same format as
+    `player/top` of the stats server).
+    """
+    raw_data = yield gen.Task(
+        top_script, KEYS, [count or settings.STATS_TOP_COUNT])
+
+    answer = []
+    for player, wins, losses, draws in raw_data:
+        wins, losses, draws = [int(float(i)) for i in (wins, losses, draws)]
+        answer.append({
+            'player': player.decode('utf-8'),
+            'quantity': wins + losses + draws,
+            'wins': wins,
+            'losses': losses,
+            'draws': draws
+        })
+    return json.dumps(answer)
+
+
+@gen.coroutine
+def get_rank(username):
+    """Return position of the player by wins (starting from 1) or None."""
+    rank = yield gen.Task(redis_client.zrevrank, KEYS[0], username)
+    return None if rank is None else rank + 1
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Load generator for the game server.
+
+Opens pairs of clients, which speak the multiplex protocol (see
+`multiplex.py`) over the raw SockJS websocket. Every pair logs in, then
+one client creates a game, the other joins it, and both play random
+legal moves until the end of the game, and so on until the time is out.
+Move latency is the time from sending `game_action` to receiving it back.
+A pair, which gets an error or doesn't get an expected message in
+`--receive_timeout` seconds, abandons its game and stops (it's counted
+in `errors`).
+
+    $ redis-server --port 6379 --save "" --appendonly no
+    $ python endpoints/game/loadtest.py stub
+    $ python endpoints/game/server.py
+    $ python endpoints/game/loadtest.py --clients=200 --duration=60
+
+`stub` runs the stub of the stats server (empty leaderboard), so the
+game server can start without the stats database.
+"""
+
+import collections
+import json
+import logging
+import os
+import random
+import time
+
+import tornado.ioloop
+import tornado.options
+import tornado.web
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.websocket import websocket_connect
+
+from play import Game
+
+CHANNELS = [
+    'username_choice', 'note', 'games_join', 'game_create', 'game_action',
+    'game_finish'
+]
+# Broadcasts are only counted (they are delivered to every client, raw
+# websocket ones included).
+BROADCAST_CHANNELS = ['games_list', 'stats']
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.games = 0
+        self.errors = 0
+        self.broadcasts = 0
+        self.started = time.time()
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[int(round(percent / 100 * (len(latencies) - 1)))]
+
+    def report(self):
+        elapsed = time.time() - self.started
+        return {
+            'games': self.games,
+            'moves': len(self.latencies),
+            'errors': self.errors,
+            'broadcasts': self.broadcasts,
+            'seconds': round(elapsed, 3),
+            'moves_per_second': round(len(self.latencies) / elapsed, 1),
+            'games_per_second': round(self.games / elapsed, 2),
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p99_ms': round(self.percentile(99) * 1000, 2)
+        }
+
+
+class ClientError(Exception):
+    pass
+
+
+class Client:
+    """Player connected to the game server. Messages of the game channels
+    (`game_action` and `game_finish`) share one queue, so they are
+    handled in the order of arrival.
+    """
+    def __init__(self, url, username, timeout):
+        self.url = url
+        self.username = username
+        self.timeout = timeout
+        self.inbox = collections.defaultdict(collections.deque)
+        self.waiters = {}
+        self.connection = None
+        self.broadcasts = 0
+
+    @gen.coroutine
+    def connect(self):
+        self.connection = yield websocket_connect(self.url)
+        for channel in CHANNELS + BROADCAST_CHANNELS:
+            self.connection.write_message('sub,{}'.format(channel))
+        self.read()
+
+        self.send('username_choice', {'username': self.username})
+        answer = yield self.receive('username_choice')
+        if answer['status'] != 'ok':
+            raise ClientError(answer['errors'])
+
+    @gen.coroutine
+    def read(self):
+        while True:
+            frame = yield self.connection.read_message()
+            if frame is None:
+                for waiter in self.waiters.values():
+                    waiter.set_exception(ClientError('Connection closed.'))
+                self.waiters.clear()
+                return
+
+            op, channel, payload = frame.split(',', 2)
+            if op != 'msg':
+                continue
+            if channel in BROADCAST_CHANNELS:
+                self.broadcasts += 1
+                continue
+            if channel in ('game_action', 'game_finish'):
+                message = (channel, json.loads(payload))
+                channel = 'game'
+            else:
+                message = json.loads(payload)
+
+            waiter = self.waiters.pop(channel, None)
+            if waiter is not None:
+                waiter.set_result(message)
+            else:
+                self.inbox[channel].append(message)
+
+    def send(self, channel, message):
+        self.connection.write_message(
+            'msg,{},{}'.format(channel, json.dumps(message)))
+
+    def receive(self, channel):
+        """Return future of the next message of the channel. It fails with
+        `ClientError`, if there is no message in `timeout` seconds.
+        """
+        future = Future()
+        if self.inbox[channel]:
+            future.set_result(self.inbox[channel].popleft())
+            return future
+
+        self.waiters[channel] = future
+        io_loop = tornado.ioloop.IOLoop.instance()
+
+        def on_timeout():
+            if self.waiters.get(channel) is future:
+                del self.waiters[channel]
+                future.set_exception(ClientError(
+                    '{}: no {} message in {} seconds.'.format(
+                        self.username, channel, self.timeout)))
+
+        timeout = io_loop.add_timeout(time.time() + self.timeout, on_timeout)
+        future.add_done_callback(lambda done: io_loop.remove_timeout(timeout))
+        return future
+
+    @gen.coroutine
+    def wait_turn(self):
+        """Wait for the note, which tells that the game has started."""
+        while True:
+            note = yield self.receive('note')
+            if 'your turn' in note['msg']:
+                return
+
+    @gen.coroutine
+    def play(self, game_id, color, dimension, lineup, stats):
+        """Play random moves till `game_finish`. The board is followed
+        locally: after the last move of the game only `game_finish` is
+        left to wait for.
+        """
+        game = Game(None, dimension, lineup)
+        empty = [
+            (x, y)
+            for x in range(1, dimension + 1) for y in range(1, dimension + 1)
+        ]
+        random.shuffle(empty)
+        turn, sent, finished = 'black', None, False
+
+        while True:
+            if turn == color and sent is None and not finished:
+                x, y = empty[-1]
+                sent = time.time()
+                self.send('game_action', {'game_id': game_id, 'x': x, 'y': y})
+
+            channel, message = yield self.receive('game')
+            if channel == 'game_finish':
+                break
+            if message['status'] != 'ok':
+                raise ClientError(message['errors'])
+
+            action = message['action']
+            empty.remove((action['x'], action['y']))
+            finished = game.action(
+                action['x'], action['y'],
+                1 if action['color'] == 'black' else 0)[1] is not None
+            if action['color'] == color:
+                stats.latencies.append(time.time() - sent)
+                sent = None
+            turn = 'white' if action['color'] == 'black' else 'black'
+
+        self.inbox['note'].clear()
+
+
+@gen.coroutine
+def play_game(creator, opponent, stats):
+    options = tornado.options.options
+    creator.send('game_create', {
+        'dimension': options.dimension,
+        'lineup': options.lineup,
+        'color': 'black'
+    })
+    answer = yield creator.receive('game_create')
+    if answer['status'] != 'ok':
+        raise ClientError(answer['errors'])
+    game_id = answer['game']['game_id']
+
+    opponent.send('games_join', {'game_id': game_id})
+    answer = yield opponent.receive('games_join')
+    if answer['status'] != 'ok':
+        raise ClientError(answer['errors'])
+
+    # The creator's first move waits for the "your turn" note.
+    yield creator.wait_turn()
+    yield [
+        creator.play(
+            game_id, 'black', options.dimension, options.lineup, stats),
+        opponent.play(
+            game_id, 'white', options.dimension, options.lineup, stats)
+    ]
+    stats.games += 1
+
+
+@gen.coroutine
+def run_pair(creator, opponent, stats, deadline):
+    """Play games till the deadline. After an error the game is abandoned
+    and the pair stops: late messages of the game would be taken for the
+    messages of the next one.
+    """
+    while time.time() < deadline:
+        try:
+            yield play_game(creator, opponent, stats)
+        except ClientError as e:
+            stats.errors += 1
+            logging.error('Game is abandoned: %s', e)
+            return
+
+
+@gen.coroutine
+def run():
+    options = tornado.options.options
+    prefix = 'load{}_'.format(os.getpid())
+    clients = [
+        Client(
+            options.url, '{}{}'.format(prefix, i), options.receive_timeout)
+        for i in range(options.clients // 2 * 2)
+    ]
+    yield [client.connect() for client in clients]
+
+    stats = Stats()
+    deadline = stats.started + options.duration
+    yield [
+        run_pair(clients[i], clients[i + 1], stats, deadline)
+        for i in range(0, len(clients), 2)
+    ]
+
+    for client in clients:
+        stats.broadcasts += client.broadcasts
+        client.connection.close()
+    return stats.report()
+
+
+class StubTopHandler(tornado.web.RequestHandler):
+    """Stats server's `player/top` with the empty leaderboard."""
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write('[]')
+
+
+if __name__ == '__main__':
+    tornado.options.define(
+        "url", default='ws://localhost:8888/socket/websocket',
+        help="Raw websocket URL of the game server", type=str)
+    tornado.options.define(
+        "clients", default=100, help="Number of clients (pairs)", type=int)
+    tornado.options.define(
+        "duration", default=30, help="Test duration in seconds", type=int)
+    tornado.options.define(
+        "receive_timeout", default=10,
+        help="Seconds to wait for the expected message", type=float)
+    tornado.options.define("dimension", default=15, type=int)
+    tornado.options.define("lineup", default=5, type=int)
+    tornado.options.define(
+        "stub_port", default=8000, help="Port of the stub stats server",
+        type=int)
+    args = tornado.options.parse_command_line()
+
+    io_loop = tornado.ioloop.IOLoop.instance()
+    if args == ['stub']:
+        app = tornado.web.Application([(r'/api/player/top', StubTopHandler)])
+        app.listen(tornado.options.options.stub_port)
+        io_loop.start()
+    else:
+        print(json.dumps(io_loop.run_sync(run), indent=4, sort_keys=True))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Counters and latency histograms of the game server process, served by
+`/metrics` in the Prometheus text format. Recording is a dict lookup and
+a bisect over a few buckets, cheap enough to stay on under load.
+
+Every series has the `worker` label (number of the worker process, see
+`server.py`), the metrics of the worker processes are not aggregated.
+"""
+
+import collections
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from tornado import gen
+
+# Upper bounds of the histogram buckets in seconds.
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+registry = []
+
+# Number of the current worker process.
+worker = 0
+
+
+def labels(*pairs):
+    """Return Prometheus labels of the series: worker label and (name,
+    value) pairs.
+    """
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, value)
+        for name, value in (('worker', worker),) + pairs))
+
+
+class Counter:
+    def __init__(self, name, label, doc):
+        self.name = name
+        self.label = label
+        self.doc = doc
+        self.values = collections.defaultdict(int)
+        registry.append(self)
+
+    def inc(self, label, value=1):
+        self.values[label] += value
+
+    def render(self):
+        yield '# HELP gomoku_{} {}'.format(self.name, self.doc)
+        yield '# TYPE gomoku_{} counter'.format(self.name)
+        for label, value in sorted(self.values.items()):
+            yield 'gomoku_{}{} {}'.format(
+                self.name, labels((self.label, label)), value)
+
+
+class Histogram:
+    def __init__(self, name, label, doc):
+        self.name = name
+        self.label = label
+        self.doc = doc
+        # Label: [counts of the buckets (and of the +Inf one), sum].
+        self.values = {}
+        registry.append(self)
+
+    def observe(self, label, seconds):
+        value = self.values.get(label)
+        if value is None:
+            value = self.values[label] = [[0] * (len(BUCKETS) + 1), 0]
+        value[0][bisect_left(BUCKETS, seconds)] += 1
+        value[1] += seconds
+
+    def render(self):
+        name = 'gomoku_{}'.format(self.name)
+        yield '# HELP {} {}'.format(name, self.doc)
+        yield '# TYPE {} histogram'.format(name)
+        for label, (counts, total) in sorted(self.values.items()):
+            count = 0
+            for bound, bucket in zip(BUCKETS + ('+Inf',), counts):
+                count += bucket
+                yield '{}_bucket{} {}'.format(
+                    name, labels((self.label, label), ('le', bound)), count)
+            yield '{}_sum{} {}'.format(
+                name, labels((self.label, label)), total)
+            yield '{}_count{} {}'.format(
+                name, labels((self.label, label)), count)
+
+
+class Gauge:
+    """Value taken from the `function` on every render."""
+    def __init__(self, name, function, doc):
+        self.name = name
+        self.function = function
+        self.doc = doc
+        registry.append(self)
+
+    def render(self):
+        yield '# HELP gomoku_{} {}'.format(self.name, self.doc)
+        yield '# TYPE gomoku_{} gauge'.format(self.name)
+        yield 'gomoku_{}{} {}'.format(self.name, labels(), self.function())
+
+
+handler_seconds = Histogram(
+    'handler_seconds', 'channel', 'Time of the channel message handling.')
+handler_errors = Counter(
+    'handler_errors', 'channel', 'Error answers sent by the channel.')
+handler_exceptions = Counter(
+    'handler_exceptions', 'channel', 'Unhandled exceptions of the channel.')
+bot_seconds = Histogram(
+    'bot_seconds', 'stage',
+    'Time of the bot turn: the move search and the whole turn.')
+redis_seconds = Histogram(
+    'redis_seconds', 'command', 'Time of the redis command.')
+redis_errors = Counter(
+    'redis_errors', 'command', 'Error replies of the redis command.')
+http_seconds = Histogram(
+    'http_seconds', 'path', 'Time of the HTTP request to the stats server.')
+http_errors = Counter(
+    'http_errors', 'path', 'Failed HTTP requests to the stats server.')
+
+
+def channel_name(connection):
+    return getattr(connection.session, 'name', connection.__class__.__name__)
+
+
+def timed(method):
+    """Coroutine method decorator, which records time of the channel
+    message handling. The untimed method is kept in the `untimed`
+    attribute, so stacked decorators (see `decorators`) time the message
+    once, by the outermost one.
+    """
+    @wraps(method)
+    @gen.coroutine
+    def new_method(self, message):
+        started = time.time()
+        try:
+            yield method(self, message)
+        except Exception:
+            handler_exceptions.inc(channel_name(self))
+            raise
+        finally:
+            handler_seconds.observe(channel_name(self), time.time() - started)
+
+    new_method.untimed = method
+    return new_method
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
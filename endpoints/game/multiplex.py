@@ -18,19 +18,22 @@ class ChannelSession(session.BaseSession):
         self.base.send('msg,{},{}'.format(chan, msg))
 
     def broadcast_channel(self, chan, clients, msg):
-        json_msg = None
+        # Multiplexed frame is built and JSON encoded once, every base
+        # session only queues the same string. Raw websocket sessions
+        # send frames as is.
+        frame = 'msg,{},{}'.format(chan, msg)
+        jsonified = proto.json_encode(frame)
 
         count = 0
 
         for c in clients:
             sess = c.session
             if not sess.is_closed:
-                if sess.send_expects_json:
-                    if json_msg is None:
-                        json_msg = proto.json_encode(msg)
-                    sess.send_jsonified(json_msg, False)
+                base_session = sess.base.session
+                if base_session.send_expects_json:
+                    base_session.send_jsonified(jsonified, False)
                 else:
-                    sess.send_message_channel(chan, msg, stats=False)
+                    base_session.send_message(frame, False)
 
                 count += 1
 
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Measurement of the participants registry
+(`MultiParticipantsConnection.participants`) with many clients.
+
+Every simulated client opens connections of the same channels as the
+load test clients (see `loadtest.py`). The registry indexed by the
+channel is compared with the former flat set of all connections, which
+broadcasts had to filter by the channel:
+
+    memory_kb - memory allocated by the registry (`tracemalloc`),
+    broadcast_ms - selection and iteration of the recipients of one
+        channel's broadcast, averaged over the channels.
+
+    $ python endpoints/game/participants_benchmark.py --clients=10000
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from base_connections import MultiParticipantsConnection
+
+CHANNELS = [
+    'username_choice', 'note', 'games_join', 'game_create', 'game_action',
+    'game_finish', 'games_list', 'stats'
+]
+
+
+class Session:
+    """Multiplex channel session, only its name is used."""
+    def __init__(self, name):
+        self.name = name
+
+
+def connections(clients):
+    return [
+        MultiParticipantsConnection(Session(channel))
+        for i in range(clients) for channel in CHANNELS
+    ]
+
+
+def indexed(items):
+    MultiParticipantsConnection.participants = {}
+    for connection in items:
+        connection.on_open(None)
+    return MultiParticipantsConnection.participants
+
+
+def indexed_targets(participants, channel):
+    return participants.get(channel, set())
+
+
+def flat(items):
+    return set(items)
+
+
+def flat_targets(participants, channel):
+    return [
+        i for i in participants
+        if getattr(i.session, 'name', None) == channel]
+
+
+def memory(build, items):
+    """Return KB allocated by building the registry of `items`."""
+    tracemalloc.start()
+    started = tracemalloc.get_traced_memory()[0]
+    participants = build(items)
+    allocated = tracemalloc.get_traced_memory()[0] - started
+    tracemalloc.stop()
+    del participants
+    return round(allocated / 1024)
+
+
+def broadcast_time(build, targets, items, repeat):
+    """Return the best of `repeat` averages of one broadcast in ms."""
+    participants = build(items)
+    best = None
+    for i in range(repeat):
+        started = time.perf_counter()
+        for channel in CHANNELS:
+            for connection in targets(participants, channel):
+                pass
+        elapsed = (time.perf_counter() - started) / len(CHANNELS)
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best * 1000, 3)
+
+
+def run(options):
+    items = connections(options.clients)
+    results = {}
+    for name, build, targets in [
+            ('indexed', indexed, indexed_targets),
+            ('flat', flat, flat_targets)]:
+        results[name] = {
+            'memory_kb': memory(build, items),
+            'broadcast_ms': broadcast_time(
+                build, targets, items, options.repeat)
+        }
+    return {
+        'clients': options.clients,
+        'connections': len(items),
+        'results': results
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--clients', type=int, default=10000, help='Number of clients')
+    parser.add_argument(
+        '--repeat', type=int, default=20,
+        help='Broadcasts of every channel, the best one is taken')
+    options = parser.parse_args()
+    print(json.dumps(run(options), indent=4, sort_keys=True))
@@ -1,26 +1,104 @@
 # -*- coding: utf-8 -*-
 
+# Horizontal, vertical, diagonal and anti-diagonal steps.
+DIRECTIONS = ((1, 0), (0, 1), (1, -1), (1, 1))
+
+# Byte values of the board cells. Stone colors are stored shifted by one,
+# so the empty board is just a zeroed bytearray.
+EMPTY = 0
+CELL_VALUES = (None, 0, 1)
+
+# Tables of `bytes.translate`: board bytes to the '0'/'1' bits of the
+# black and white stones bitmaps.
+BLACK_BITS = bytes.maketrans(b'\x00\x01\x02', b'001')
+WHITE_BITS = bytes.maketrans(b'\x00\x01\x02', b'010')
+
+
+def unpack_move(data):
+    """Return (x, y, color) tuple of the move packed by the `MOVE` script
+    into 3 bytes: x, y and color.
+    """
+    return tuple(data)
+
 
 class Game:
     """Game with matrix representation:
         0 - white stone
         1 - black stone
         None - empty cell
+
+    Internally cells are stored row by row in the `board` bytearray
+    (one byte per cell, see `EMPTY` and `CELL_VALUES`), `to_bytes` returns
+    it as a stable binary serialization. All byte values are ASCII.
     """
     def __init__(self, matrix=None, dimension=None, lineup=None):
-        if not matrix:
-            self.matrix = [[None] * dimension for i in range(dimension)]
-        else:
-            self.matrix = matrix
-
         self.dimension = dimension
         self.lineup = lineup
+        self.board = bytearray(dimension * dimension)
+        self.moves = 0
+
+        if matrix:
+            for y, row in enumerate(matrix):
+                for x, stone in enumerate(row):
+                    if stone is not None:
+                        self.board[y * dimension + x] = stone + 1
+                        self.moves += 1
+
+    @classmethod
+    def from_bytes(cls, data, dimension, lineup=None):
+        """Build game from the `to_bytes` serialization."""
+        game = cls(None, dimension, lineup)
+        game.board[:] = data
+        game.moves = len(data) - data.count(EMPTY)
+        return game
+
+    def apply_moves(self, moves):
+        """Put the packed moves (see `unpack_move`) on the board without
+        checking of the game status.
+        """
+        for data in moves:
+            x, y, color = unpack_move(data)
+            self.set_cell(x, y, color)
+            self.moves += 1
+
+    def to_bytes(self):
+        return bytes(self.board)
+
+    def bitmaps(self):
+        """Return (black, white) bitmaps of the board as bytes. Cell with
+        index i (row by row) is the bit 7 - i % 8 of the byte i // 8.
+        Built by `translate` and `int`, without objects per cell.
+        """
+        size = (len(self.board) + 7) // 8
+        padding = b'0' * (size * 8 - len(self.board))
+        return tuple(
+            int(self.board.translate(table) + padding, 2).to_bytes(size, 'big')
+            for table in (BLACK_BITS, WHITE_BITS)
+        )
+
+    def copy(self):
+        game = Game(None, self.dimension, self.lineup)
+        game.board[:] = self.board
+        game.moves = self.moves
+        return game
+
+    @property
+    def matrix(self):
+        """Board as list of lists (the old JSON format)."""
+        d = self.dimension
+        return [
+            [CELL_VALUES[i] for i in self.board[y * d:(y + 1) * d]]
+            for y in range(d)
+        ]
 
     def get_cell(self, x, y):
-        return self.matrix[y - 1][x - 1]
+        if not (1 <= x <= self.dimension and 1 <= y <= self.dimension):
+            raise IndexError('Cell is out of the board.')
+        return CELL_VALUES[self.board[(y - 1) * self.dimension + x - 1]]
 
     def set_cell(self, x, y, value):
-        self.matrix[y - 1][x - 1] = value
+        self.board[(y - 1) * self.dimension + x - 1] = \
+            EMPTY if value is None else value + 1
 
     def action(self, x, y, color):
         if x <= 0 or y <= 0:
@@ -35,86 +113,36 @@ class Game:
             return False, None
 
         self.set_cell(x, y, color)
+        self.moves += 1
         return True, self.status(x, y, color)
 
     def is_filled(self):
-        for row in self.matrix:
-            for stone in row:
-                if stone is None:
-                    return False
-        return True
-
-    def is_lineup(self, x, y, color):
-        # Horizontal roundtrip.
-        count = 0
-        for obj in self.matrix[y - 1]:
-            if obj == color:
-                count += 1
-                if count == self.lineup:
-                    return True
-            else:
-                count = 0
-
-        # Vertical roundtrip.
-        count = 0
-        for i in range(1, self.dimension + 1):
-            if self.get_cell(x, i) == color:
-                count += 1
-                if count == self.lineup:
-                    return True
-            else:
-                count = 0
-
-        # Diagonal roundtrip.
-        # Intersection with left side.
-        x1, y1 = 1, x + y - 1
-        # Intersection with downside.
-        x2, y2 = x + y - self.dimension, self.dimension
-
-        if y1 <= self.dimension:
-            pos_x = x1
-            pos_y = y1
-        else:
-            pos_x = x2
-            pos_y = y2
-
+        return self.moves == self.dimension * self.dimension
+
+    def count_direction(self, x, y, dx, dy, color):
+        """Count stones of the `color` going from the (x, y) cell
+        (exclusive) in the (dx, dy) direction. Counting stops at the
+        `lineup` - 1 stones, more is never needed.
+        """
+        board, d, value = self.board, self.dimension, color + 1
         count = 0
-        while (pos_x <= self.dimension) and (pos_y >= 1):
-            if self.get_cell(pos_x, pos_y) == color:
-                count += 1
-                if count == self.lineup:
-                    return True
-            else:
-                count = 0
-
-            pos_x += 1
-            pos_y -= 1
-
-        # Anti-diagonal roundtrip.
-        # Intersection with left side.
-        x1, y1 = 1 + (x - y), 1
-        # Intersection with downside.
-        x2, y2 = 1, 1 - (x - y)
-
-        if x1 >= 1:
-            pos_x = x1
-            pos_y = y1
-        else:
-            pos_x = x2
-            pos_y = y2
-
-        count = 0
-        while (pos_x <= self.dimension) and (pos_y <= self.dimension):
-            if self.get_cell(pos_x, pos_y) == color:
-                count += 1
-                if count == self.lineup:
-                    return True
-            else:
-                count = 0
-
-            pos_x += 1
-            pos_y += 1
+        x, y = x + dx, y + dy
+        while count < self.lineup - 1 and 1 <= x <= d and 1 <= y <= d:
+            if board[(y - 1) * d + x - 1] != value:
+                break
+            count += 1
+            x, y = x + dx, y + dy
+        return count
 
+    def is_lineup(self, x, y, color):
+        """Check lines (horizontal, vertical, diagonal, anti-diagonal)
+        going through the last placed stone only.
+        """
+        for dx, dy in DIRECTIONS:
+            count = 1 + self.count_direction(x, y, dx, dy, color) + \
+                self.count_direction(x, y, -dx, -dy, color)
+            if count >= self.lineup:
+                return True
         return False
 
     def status(self, x, y, color):
@@ -129,12 +157,12 @@ class Game:
 
     def serialize_cells(self):
         result = []
-        for y, row in enumerate(self.matrix):
-            for x, stone in enumerate(row):
-                if stone is not None:
-                    result.append({
-                        'x': x + 1,
-                        'y': y + 1,
-                        'color': 'black' if stone == 1 else 'white'
-                    })
+        d = self.dimension
+        for i, value in enumerate(self.board):
+            if value != EMPTY:
+                result.append({
+                    'x': i % d + 1,
+                    'y': i // d + 1,
+                    'color': 'black' if CELL_VALUES[value] == 1 else 'white'
+                })
         return result
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+
+from clients import redis_client
+
+
+class RedisScript:
+    """Lua script, which is running on the redis server. Script is called
+    by its SHA1 digest and the source is sent only if redis doesn't know
+    it yet. Metrics of the calls are recorded by the `name`. Can be used
+    with `gen.Task`:
+
+        result = yield gen.Task(script, keys, args)
+    """
+    def __init__(self, client, source, name):
+        self.client = client
+        self.source = source
+        self.label = 'script:{}'.format(name)
+        self.sha = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def __call__(self, keys, args, callback=None):
+        keys, args = list(keys), list(args)
+
+        def on_reply(reply):
+            if isinstance(reply, Exception) and \
+                    str(reply).startswith('NOSCRIPT'):
+                self.client.send_message(
+                    ['EVAL', self.source, len(keys)] + keys + args, callback,
+                    label=self.label)
+            elif callback is not None:
+                callback(reply)
+
+        self.client.send_message(
+            ['EVALSHA', self.sha, len(keys)] + keys + args, on_reply,
+            label=self.label)
+
+
+# Commit of the player's move. Win (line of `lineup` stones through the
+# new one) and draw (full board) are detected here too, and the finished
+# game is deleted, so no move can follow the last one. Only the cells
+# around the new stone are read, and stones are counted by the length of
+# the moves list plus `legacy` stones (placed before the list existed).
+# Games without the binary board (or without the snapshot) are converted
+# at their first move.
+# KEYS: games:id:<id>, games:moves:<id>, games:activity
+# ARGV: username, x, y, snapshot interval, game TTL, current time, game id
+# Returns ['error', message] or ['ok', creator, opponent, dimension,
+# lineup, color, turn, board, moves, status, history], where `board` is
+# the last snapshot, `moves` are packed moves made after it (without the
+# new one), `status` is 'win', 'draw' or nil, and `history` is all packed
+# moves of the finished game.
+MOVE = """
+local game = redis.call('HMGET', KEYS[1],
+    'creator', 'opponent', 'dimension', 'lineup', 'color', 'turn',
+    'board', 'matrix', 'snapshot', 'legacy')
+local creator, opponent, turn = game[1], game[2], game[6]
+local username = ARGV[1]
+local x, y = tonumber(ARGV[2]), tonumber(ARGV[3])
+
+if not creator then
+    return {'error', 'This game not existed or already finished.'}
+end
+if not opponent then
+    return {'error', 'Need opponent to join to the game.'}
+end
+if username ~= creator and username ~= opponent then
+    return {'error', 'You are not participant of this game.'}
+end
+if username ~= turn then
+    return {'error',
+        "It's not your turn. Please, wait for your opponent's move."}
+end
+
+local dimension = tonumber(game[3])
+if not x or not y or x < 1 or y < 1 or x > dimension or y > dimension then
+    return {'error', 'Bad action.'}
+end
+
+local board, snapshot = game[7], tonumber(game[9])
+local legacy = tonumber(game[10]) or 0
+if not board and not game[8] then
+    board, snapshot = string.rep(string.char(0), dimension * dimension), 0
+elseif not snapshot then
+    -- Games saved before the moves list (their stones aren't in it), and
+    -- before the binary board (JSON matrix only).
+    if not board then
+        local matrix = cjson.decode(game[8])
+        local cells = {}
+        for j = 1, dimension do
+            for i = 1, dimension do
+                local stone = matrix[j] and matrix[j][i]
+                if stone and stone ~= cjson.null then
+                    cells[#cells + 1] = string.char(stone + 1)
+                else
+                    cells[#cells + 1] = string.char(0)
+                end
+            end
+        end
+        board = table.concat(cells)
+    end
+    local _, empty = string.gsub(board, '%z', '')
+    legacy, snapshot = #board - empty, 0
+    redis.call('HMSET', KEYS[1],
+        'board', board, 'snapshot', 0, 'legacy', legacy)
+end
+
+-- Stones placed after the snapshot by the cell index.
+local placed = {}
+local moves = redis.call('LRANGE', KEYS[2], snapshot, -1)
+for _, packed in ipairs(moves) do
+    local i, j, value = string.byte(packed, 1, 3)
+    placed[(j - 1) * dimension + i] = value + 1
+end
+
+local function cell(i, j)
+    local index = (j - 1) * dimension + i
+    return placed[index] or string.byte(board, index)
+end
+
+if cell(x, y) ~= 0 then
+    return {'error', 'Bad action.'}
+end
+
+local black = (username == creator) == (game[5] == 'black')
+local move = string.char(x, y, black and 1 or 0)
+local stone = string.byte(move, 3) + 1
+placed[(y - 1) * dimension + x] = stone
+
+local status
+local lineup = tonumber(game[4])
+for _, step in ipairs({{1, 0}, {0, 1}, {1, -1}, {1, 1}}) do
+    local count = 1
+    for _, sign in ipairs({1, -1}) do
+        local dx, dy = step[1] * sign, step[2] * sign
+        local i, j = x + dx, y + dy
+        while count < lineup and i >= 1 and j >= 1 and
+                i <= dimension and j <= dimension and
+                cell(i, j) == stone do
+            count = count + 1
+            i, j = i + dx, j + dy
+        end
+    end
+    if count >= lineup then
+        status = 'win'
+        break
+    end
+end
+
+local length = redis.call('RPUSH', KEYS[2], move)
+if not status and length + legacy == dimension * dimension then
+    status = 'draw'
+end
+if status then
+    local history = redis.call('LRANGE', KEYS[2], 0, -1)
+    redis.call('DEL', KEYS[1], KEYS[2])
+    redis.call('ZREM', KEYS[3], ARGV[7])
+    return {'ok', creator, opponent, game[3], game[4], game[5], turn,
+        board, moves, status, history}
+end
+
+turn = turn == creator and opponent or creator
+redis.call('HSET', KEYS[1], 'turn', turn)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+redis.call('ZADD', KEYS[3], ARGV[6], ARGV[7])
+
+if length % tonumber(ARGV[4]) == 0 then
+    local cells = {string.byte(board, 1, -1)}
+    for index, value in pairs(placed) do
+        cells[index] = value
+    end
+    redis.call('HMSET', KEYS[1],
+        'board', string.char(unpack(cells)), 'snapshot', length)
+end
+
+return {'ok', creator, opponent, game[3], game[4], game[5], turn,
+    board, moves}
+"""
+
+move_script = RedisScript(redis_client, MOVE, 'move')
+
+
+# Resignation of the player: the game is deleted like the finished one.
+# KEYS: games:id:<id>, games:moves:<id>, games:activity
+# ARGV: username, game id
+# Returns ['error', message] or ['ok', creator, opponent, dimension,
+# lineup, color, history], where `history` is all packed moves.
+RESIGN = """
+local game = redis.call('HMGET', KEYS[1],
+    'creator', 'opponent', 'dimension', 'lineup', 'color')
+if not game[1] then
+    return {'error', 'This game not existed or already finished.'}
+end
+if not game[2] then
+    return {'error', 'Need opponent to join to the game.'}
+end
+if ARGV[1] ~= game[1] and ARGV[1] ~= game[2] then
+    return {'error', 'You are not participant of this game.'}
+end
+
+local history = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('ZREM', KEYS[3], ARGV[2])
+return {'ok', game[1], game[2], game[3], game[4], game[5], history}
+"""
+
+resign_script = RedisScript(redis_client, RESIGN, 'resign')
+
+
+# Lua function, which removes the game from the lobby by the index keys
+# saved by the `LOBBY` script, and the game itself, if `delete` is true.
+# Returns the new version of the list (or false, if the game isn't in the
+# lobby).
+REMOVE_FROM_LOBBY = """
+local function remove_from_lobby(id, delete)
+    if delete then
+        redis.call('DEL', 'games:id:' .. id, 'games:moves:' .. id)
+        redis.call('ZREM', 'games:activity', id)
+    end
+    local keys = redis.call('HGET', 'games:lobby:keys', id)
+    if not keys then
+        return false
+    end
+    for key in string.gmatch(keys, '%S+') do
+        redis.call('ZREM', key, id)
+    end
+    redis.call('HDEL', 'games:lobby:games', id)
+    redis.call('HDEL', 'games:lobby:keys', id)
+    return redis.call('INCR', 'games:version')
+end
+"""
+
+
+# Change of the list of games (lobby) with the bump of its version. Index
+# keys of the added game are saved, so scripts can remove it from the
+# lobby (see `REMOVE_FROM_LOBBY`).
+# KEYS: games:version, games:lobby:games, games:lobby:keys, index keys
+# (see `utils.lobby_keys` and `utils.open_games_key`)
+# ARGV: 'add' or 'remove', game id, JSON of the game
+# Returns the new version of the list.
+LOBBY = """
+for i = 4, #KEYS do
+    if ARGV[1] == 'add' then
+        redis.call('ZADD', KEYS[i], ARGV[2], ARGV[2])
+    else
+        redis.call('ZREM', KEYS[i], ARGV[2])
+    end
+end
+if ARGV[1] == 'add' then
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+    redis.call('HSET', KEYS[3], ARGV[2],
+        table.concat({unpack(KEYS, 4)}, ' '))
+else
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    redis.call('HDEL', KEYS[3], ARGV[2])
+end
+return redis.call('INCR', KEYS[1])
+"""
+
+lobby_script = RedisScript(redis_client, LOBBY, 'lobby')
+
+
+# Join of the opponent to the game, which waits for it. The game is
+# removed from the lobby (the removal is broadcast by the caller).
+# KEYS: games:id:<id>, games:moves:<id>, games:activity
+# ARGV: username, game TTL, current time, game id
+# Returns ['error', message] or ['ok', creator, dimension, color, board,
+# matrix, moves, version], where `moves` are packed moves made
+# after the `board` snapshot (or the `matrix` of the old games), and
+# `version` is the new version of the list of games or nil.
+JOIN = REMOVE_FROM_LOBBY + """
+local game = redis.call('HMGET', KEYS[1],
+    'creator', 'opponent', 'dimension', 'color', 'board', 'matrix',
+    'snapshot')
+local creator, username = game[1], ARGV[1]
+if not creator then
+    return {'error', 'Wrong game id.'}
+end
+if game[2] then
+    return {'error', 'Game is already started.'}
+end
+if username == creator then
+    return {'error', "You can't play with youself."}
+end
+
+local turn = game[4] == 'black' and creator or username
+redis.call('HMSET', KEYS[1], 'opponent', username, 'turn', turn)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[4])
+
+local moves = redis.call('LRANGE', KEYS[2], tonumber(game[7]) or 0, -1)
+return {'ok', creator, game[3], game[4], game[5], game[6], moves,
+    remove_from_lobby(ARGV[4], false)}
+"""
+
+join_script = RedisScript(redis_client, JOIN, 'join')
+
+
+# Page of the lobby index.
+# KEYS: lobby index key, games:lobby:games
+# ARGV: offset, limit
+# Returns [total, list of games JSON].
+LOBBY_PAGE = """
+local ids = redis.call('ZRANGE', KEYS[1], ARGV[1], ARGV[1] + ARGV[2] - 1)
+local games = {}
+if #ids > 0 then
+    games = redis.call('HMGET', KEYS[2], unpack(ids))
+end
+return {redis.call('ZCARD', KEYS[1]), games}
+"""
+
+lobby_page_script = RedisScript(redis_client, LOBBY_PAGE, 'lobby_page')
+
+
+# Update of the leaderboard with the finished round.
+# KEYS: stats:wins, stats:losses, stats:draws
+# ARGV: creator, opponent, winner (empty string for the draw)
+RECORD_ROUND = """
+for i = 1, 2 do
+    local player, winner = ARGV[i], ARGV[3]
+    local win = winner == player and 1 or 0
+    local draw = winner == '' and 1 or 0
+    redis.call('ZINCRBY', KEYS[1], win, player)
+    redis.call('ZINCRBY', KEYS[2], 1 - win - draw, player)
+    redis.call('ZINCRBY', KEYS[3], draw, player)
+end
+"""
+
+record_round_script = RedisScript(redis_client, RECORD_ROUND, 'record_round')
+
+
+# Top of the leaderboard.
+# KEYS: stats:wins, stats:losses, stats:draws
+# ARGV: count
+# Returns list of [player, wins, losses, draws].
+TOP = """
+local top = redis.call('ZREVRANGE', KEYS[1], 0, ARGV[1] - 1, 'WITHSCORES')
+local result = {}
+for i = 1, #top, 2 do
+    result[#result + 1] = {top[i], top[i + 1],
+        redis.call('ZSCORE', KEYS[2], top[i]) or '0',
+        redis.call('ZSCORE', KEYS[3], top[i]) or '0'}
+end
+return result
+"""
+
+top_script = RedisScript(redis_client, TOP, 'top')
+
+
+# Initial filling of the leaderboard. Players, who are already there
+# (their rounds are recorded while the seed is loaded), are skipped.
+# KEYS: stats:wins, stats:losses, stats:draws
+# ARGV: player, wins, losses, draws, player, wins, ...
+SEED = """
+for i = 1, #ARGV, 4 do
+    if not redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        for j = 1, 3 do
+            redis.call('ZADD', KEYS[j], ARGV[i + j], ARGV[i])
+        end
+    end
+end
+"""
+
+seed_script = RedisScript(redis_client, SEED, 'seed')
+
+
+# Login of the player: the username is taken, if nobody has it yet.
+# KEYS: players:all, players:seen, players:counter, players:token:<token>
+# ARGV: username, token, current time
+# Returns id of the new player or nil, if the username is taken.
+CREATE_PLAYER = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return false
+end
+local user_id = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+redis.call('SET', 'players:id:' .. user_id, ARGV[1])
+redis.call('HMSET', 'players:session:' .. ARGV[1],
+    'user_id', user_id, 'token', ARGV[2], 'generation', 0)
+redis.call('SET', KEYS[4], ARGV[1])
+return user_id
+"""
+
+create_player_script = RedisScript(
+    redis_client, CREATE_PLAYER, 'create_player')
+
+
+# Resume of the player's session: bump of the session generation, so the
+# removal scheduled by the disconnected connection is cancelled.
+# KEYS: players:token:<token>
+# Returns nil (expired session) or [username, generation, user id].
+RESUME = """
+local username = redis.call('GET', KEYS[1])
+if not username then
+    return false
+end
+local key = 'players:session:' .. username
+local generation = redis.call('HINCRBY', key, 'generation', 1)
+return {username, generation, redis.call('HGET', key, 'user_id')}
+"""
+
+resume_script = RedisScript(redis_client, RESUME, 'resume')
+
+
+# Removal of the player, if the session wasn't resumed, with the open
+# games of the player.
+# KEYS: players:session:<username>, players:all, players:token:<token>,
+# players:id:<user id>, players:seen, games:open:<username>
+# ARGV: username, generation of the session
+# Returns false, if the session was resumed, or list of [game id, new
+# version of the list of games] of the removed games.
+EXPIRE_PLAYER = REMOVE_FROM_LOBBY + """
+if redis.call('HGET', KEYS[1], 'generation') ~= ARGV[2] then
+    return false
+end
+redis.call('DEL', KEYS[1], KEYS[3], KEYS[4])
+redis.call('SREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[5], ARGV[1])
+
+local result = {}
+for _, id in ipairs(redis.call('ZRANGE', KEYS[6], 0, -1)) do
+    result[#result + 1] = {id, remove_from_lobby(id, true)}
+end
+redis.call('DEL', KEYS[6])
+return result
+"""
+
+expire_player_script = RedisScript(
+    redis_client, EXPIRE_PLAYER, 'expire_player')
+
+
+# Players connected to the server process are alive: their records
+# expire after TTL without heartbeats.
+# KEYS: players:seen
+# ARGV: player TTL, current time, username, username, ...
+HEARTBEAT = """
+for i = 3, #ARGV do
+    local key = 'players:session:' .. ARGV[i]
+    local session = redis.call('HMGET', key, 'token', 'user_id')
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[i])
+    redis.call('EXPIRE', key, ARGV[1])
+    if session[1] then
+        redis.call('EXPIRE', 'players:token:' .. session[1], ARGV[1])
+    end
+    if session[2] then
+        redis.call('EXPIRE', 'players:id:' .. session[2], ARGV[1])
+    end
+end
+"""
+
+heartbeat_script = RedisScript(redis_client, HEARTBEAT, 'heartbeat')
+
+
+# Removal of the players without heartbeats (their server has crashed)
+# with their open games.
+# KEYS: players:seen, players:all
+# ARGV: time of the last heartbeat of the alive player, max count
+# Returns [number of removed players, list of [game id, new version of
+# the list of games] of the removed games].
+SWEEP_PLAYERS = REMOVE_FROM_LOBBY + """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+    'LIMIT', 0, ARGV[2])
+local games = {}
+for _, username in ipairs(stale) do
+    local key = 'players:session:' .. username
+    local session = redis.call('HMGET', key, 'token', 'user_id')
+    if session[1] then
+        redis.call('DEL', 'players:token:' .. session[1])
+    end
+    if session[2] then
+        redis.call('DEL', 'players:id:' .. session[2])
+    end
+    redis.call('DEL', key)
+    redis.call('SREM', KEYS[2], username)
+    redis.call('ZREM', KEYS[1], username)
+
+    local open = 'games:open:' .. username
+    for _, id in ipairs(redis.call('ZRANGE', open, 0, -1)) do
+        games[#games + 1] = {id, remove_from_lobby(id, true)}
+    end
+    redis.call('DEL', open)
+end
+return {#stale, games}
+"""
+
+sweep_players_script = RedisScript(
+    redis_client, SWEEP_PLAYERS, 'sweep_players')
+
+
+# Removal of the games without activity (and of their lobby entries).
+# KEYS: games:activity
+# ARGV: time of the last activity of the alive game, max count
+# Returns list of [game id, new version of the list of games or false].
+SWEEP_GAMES = REMOVE_FROM_LOBBY + """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+    'LIMIT', 0, ARGV[2])
+local result = {}
+for i, id in ipairs(ids) do
+    result[i] = {id, remove_from_lobby(id, true)}
+end
+return result
+"""
+
+sweep_games_script = RedisScript(redis_client, SWEEP_GAMES, 'sweep_games')
+
+
+# Adding of the players and lobby games saved before the expiry to the
+# heartbeat and activity indexes (see `expiry.backfill`).
+# KEYS: index (players:seen or games:activity), set or hash of the
+# members (players:all or games:lobby:games)
+# ARGV: 'SISMEMBER' or 'HEXISTS' (check of the member), score, member,
+# member, ...
+BACKFILL = """
+for i = 3, #ARGV do
+    if redis.call(ARGV[1], KEYS[2], ARGV[i]) == 1 and
+            not redis.call('ZSCORE', KEYS[1], ARGV[i]) then
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[i])
+    end
+end
+"""
+
+backfill_script = RedisScript(redis_client, BACKFILL, 'backfill')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Delivery of messages between game server processes through the redis
+publish/subscribe channels.
+"""
+
+from clients import redis_client, pubsub_client
+
+callbacks = {}
+
+
+def on_message(reply):
+    # None is passed when the connection is lost.
+    if reply is None or reply[0] != b'message':
+        return
+
+    callback = callbacks.get(reply[1].decode('utf-8'))
+    if callback is not None:
+        callback(reply[2].decode('utf-8'))
+
+
+def subscribe(channel, callback):
+    """Call `callback(message)` for every message published to the redis
+    `channel` (by any process).
+    """
+    # Without connection it's subscribed after the reconnect.
+    if channel not in callbacks and pubsub_client.is_connected():
+        pubsub_client.subscribe(channel, callback=on_message)
+    callbacks[channel] = callback
+
+
+def unsubscribe(channel):
+    if callbacks.pop(channel, None) is not None and \
+            pubsub_client.is_connected():
+        pubsub_client.unsubscribe(channel)
+
+
+def resubscribe():
+    """Restore subscriptions after the reconnect of `pubsub_client`."""
+    if callbacks:
+        pubsub_client.subscribe(list(callbacks), callback=on_message)
+
+
+pubsub_client.on_connect = resubscribe
+
+
+def publish(channel, message):
+    """Publish message without waiting for the reply. Messages published
+    by one process are delivered in the same order.
+    """
+    redis_client.publish(channel, message)
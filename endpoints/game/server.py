@@ -4,13 +4,16 @@ import tornado.ioloop
 import tornado.web
 import tornado.autoreload
 import tornado.options
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
 
 from jinja2 import Environment, FileSystemLoader
 from sockjs.tornado import SockJSRouter
 
 from multiplex import MultiplexConnection
-import connections
 from utils import rel
+import metrics
 import settings
 
 
@@ -20,13 +23,48 @@ class IndexHandler(tornado.web.RequestHandler):
         env = Environment(loader=FileSystemLoader(settings.TEMPLATE_PATH))
         self.write(env.get_template('index.html').render())
 
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Metrics of the server process (see `metrics`). Every worker
+    process has its own metrics, so with several workers they are scraped
+    from the `--metrics_port` of every worker.
+    """
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.render())
+
 if __name__ == '__main__':
     import logging
     logging.getLogger().setLevel(logging.DEBUG)
     tornado.options.define("port", default=8888, help="Run on port", type=int)
     tornado.options.define("address", default='localhost', help="Run on host", type=str)
+    tornado.options.define(
+        "workers", default=1, type=int,
+        help="Number of worker processes (0 - one per CPU)")
+    tornado.options.define(
+        "metrics_port", default=0, type=int,
+        help="Worker N serves its metrics on this port + N (0 - disabled)")
     tornado.options.parse_command_line()
 
+    sockets = tornado.netutil.bind_sockets(
+        tornado.options.options.port,
+        address=tornado.options.options.address
+    )
+    if tornado.options.options.workers != 1:
+        metrics.worker = tornado.process.fork_processes(
+            tornado.options.options.workers)
+
+    # Modules with redis and http clients can be imported only after fork,
+    # the clients are bound to the IOLoop of the process.
+    import connections
+    import leaderboard
+    import expiry
+    from base_connections import BaseConnection, subscribe_broadcasts
+
+    metrics.Gauge(
+        'players', lambda: len(BaseConnection.players),
+        'Players logged in to the server process.')
+
     # Create multiplexer
     channels = {
         'username_choice': connections.UsernameChoiceConnection,
@@ -36,26 +74,42 @@ if __name__ == '__main__':
         'games_join': connections.GamesJoinConnection,
         'game_create': connections.GameCreateConnection,
         'game_action': connections.GameActionConnection,
-        'game_finish': connections.GameFinishConnection
+        'game_finish': connections.GameFinishConnection,
+        'game_watch': connections.GameWatchConnection
     }
 
     router = MultiplexConnection.get(**channels)
 
-    # Register multiplexer
-    MainSocketRouter = SockJSRouter(router, '/socket')
+    # Register multiplexer. Messages of all channels sent to the same
+    # client within one IOLoop iteration are flushed as one SockJS frame.
+    MainSocketRouter = SockJSRouter(
+        router, '/socket', dict(immediate_flush=False))
 
     # Create application
     app = tornado.web.Application(
         [
             (r'/', IndexHandler),
+            (r'/metrics', MetricsHandler),
             (r'/static/(.*)', tornado.web.StaticFileHandler, {'path': rel('static')},),
         ] + MainSocketRouter.urls
     )
-    app.listen(
-        tornado.options.options.port,
-        address=tornado.options.options.address
-    )
 
     io_loop = tornado.ioloop.IOLoop.instance()
-    tornado.autoreload.start(io_loop)
+    # Server doesn't wait for the stats server (leaderboard is empty till
+    # the seed is loaded).
+    io_loop.add_callback(leaderboard.seed)
+    subscribe_broadcasts()
+    expiry.start()
+
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets(sockets)
+
+    if tornado.options.options.metrics_port:
+        metrics_app = tornado.web.Application([(r'/metrics', MetricsHandler)])
+        metrics_app.listen(
+            tornado.options.options.metrics_port + metrics.worker,
+            address=tornado.options.options.address)
+
+    if tornado.options.options.workers == 1:
+        tornado.autoreload.start(io_loop)
     io_loop.start()
@@ -4,3 +4,75 @@ from utils import rel
 
 
 TEMPLATE_PATH = rel('templates')
+
+# Every N moves the whole board is saved next to the game's move log,
+# so loading of the game replays at most N moves.
+SNAPSHOT_INTERVAL = 32
+
+# Lobby (list of games) pages.
+LOBBY_PAGE_SIZE = 50
+LOBBY_MAX_LIMIT = 100
+# Max number of different cached pages between changes of the lobby.
+LOBBY_CACHE_SIZE = 256
+
+# API of the stats server.
+STATS_URL = 'http://localhost:8000/api/'
+# Deadlines (seconds) and max parallel requests.
+STATS_CONNECT_TIMEOUT = 2
+STATS_REQUEST_TIMEOUT = 20
+STATS_MAX_CLIENTS = 10
+# After this number of failed requests in a row the requests aren't sent
+# for `STATS_RETRY_AFTER` seconds (last known answers are used).
+STATS_MAX_FAILURES = 3
+STATS_RETRY_AFTER = 30
+
+# Leaderboard.
+STATS_TOP_COUNT = 10
+# Players loaded from the stats server when the leaderboard is empty
+# (added by batches).
+STATS_SEED_COUNT = 100000
+STATS_SEED_BATCH = 1000
+# Seconds, after which the loading is taken for failed (the process has
+# died), and delays of the retries after failures (checked every
+# `SWEEP_INTERVAL`).
+STATS_SEED_TIMEOUT = 5 * 60
+STATS_SEED_RETRY_DELAY = 60
+STATS_SEED_MAX_RETRY_DELAY = 30 * 60
+
+# Redis list of the finished rounds, drained by the stats server.
+ROUNDS_QUEUE = 'rounds:queue'
+
+# Computer opponent. Username doesn't match the login regexp, so nobody
+# can take it.
+BOT_USERNAME = '@bot'
+# Limits of the search per move.
+BOT_TIME_LIMIT = 1.0
+BOT_NODE_LIMIT = 20000
+# Max moves considered in every position.
+BOT_BRANCHING = 12
+BOT_PROCESSES = 2
+
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+# Connections of the pool. Commands sent within one IOLoop iteration are
+# written to a connection at once (one network round trip).
+REDIS_POOL_SIZE = 4
+# Delay of the reconnect after the loss of connection, doubled after
+# every failed attempt up to the max.
+REDIS_RECONNECT_DELAY = 0.1
+REDIS_MAX_RECONNECT_DELAY = 10
+# Max commands waiting for the reconnect (per connection), others fail.
+REDIS_MAX_PENDING = 10000
+
+# Seconds during which the disconnected player can resume the session by
+# token, the player (and the username) is removed after it.
+RESUME_GRACE = 30
+
+# Keys of the game expire after this number of seconds without moves.
+GAME_TTL = 60 * 60
+# Keys of the player expire after this number of seconds without
+# heartbeats of the player's server (sent every `SWEEP_INTERVAL`).
+PLAYER_TTL = 5 * 60
+SWEEP_INTERVAL = 60
+# Max players (games) handled by one redis script call.
+SWEEP_BATCH = 1000
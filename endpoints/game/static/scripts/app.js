@@ -7,24 +7,62 @@ window.app = {
 	currentView: null,
 	socket: null,
 	channel: {},
+	token: null,
+	channelNames: {
+		usernameChoiceSock: 'username_choice',
+		statsSock: 'stats',
+		noteSock: 'note',
+		gamesListSock: 'games_list',
+		gamesJoinSock: 'games_join',
+		gameCreateSock: 'game_create',
+		gameActionSock: 'game_action',
+		gameFinishSock: 'game_finish',
+		gameWatchSock: 'game_watch'
+	},
 
 	init: function() {
-		var sock_url = '/socket';
-		this.sock = new SockJS(sock_url);
+		this.connect();
+
+		app.view.stats.init();
+		app.goto("nickname");
+	},
+
+	connect: function() {
+		var self = this;
+		this.sock = new SockJS('/socket');
 
 		var multiplexer = new WebSocketMultiplex(this.sock);
 
-		this.channel.usernameChoiceSock = multiplexer.channel('username_choice');
-		this.channel.statsSock = multiplexer.channel('stats');
-		this.channel.noteSock = multiplexer.channel('note');
-		this.channel.gamesListSock = multiplexer.channel('games_list');
-		this.channel.gamesJoinSock = multiplexer.channel('games_join');
-		this.channel.gameCreateSock = multiplexer.channel('game_create');
-		this.channel.gameActionSock = multiplexer.channel('game_action');
-		this.channel.gameFinishSock = multiplexer.channel('game_finish');
+		// Handlers set by the views are kept by the new channels.
+		$.each(this.channelNames, function(key, name) {
+			var old = self.channel[key];
+			self.channel[key] = multiplexer.channel(name);
+			if (old) {
+				self.channel[key].onmessage = old.onmessage;
+			}
+		});
 
-		app.view.stats.init();
-		app.goto("nickname");
+		this.sock.onclose = function() {
+			// Random delay spreads reconnects of all clients.
+			setTimeout(function() { self.reconnect(); }, 1000 + Math.random() * 4000);
+		};
+	},
+
+	reconnect: function() {
+		this.connect();
+		if (!this.token) {
+			return;
+		}
+
+		// Resume the session, the server sends the missed moves only.
+		this.channel.usernameChoiceSock.onopen = function() {
+			var message = {"token": app.token};
+			if (app.currentView == "game") {
+				message.game_id = app.view.game.model.game_id;
+				message.seq = app.view.game.seq;
+			}
+			app.channel.usernameChoiceSock.send(JSON.stringify(message));
+		};
 	},
 
 	goto: function(view, model) {
@@ -154,7 +192,19 @@ app.view.nickname = {
 			if (obj.status == 'ok'){
 				app.user_id = obj.user_id;
 				app.username = obj.username;
-				app.goto("games");
+				app.token = obj.token;
+				if (obj.resumed) {
+					self.resume();
+				}
+				else {
+					app.goto("games");
+				}
+			}
+			else if (app.token) {
+				// Session is not resumed.
+				app.token = null;
+				app.goto("nickname");
+				app.view.error.init(obj.errors);
 			}
 			else {
 				app.view.error.init(obj.errors);
@@ -176,6 +226,15 @@ app.view.nickname = {
 		this.events();
 	},
 
+	resume: function() {
+		if (app.currentView == "games") {
+			app.channel.gamesListSock.send('');
+		}
+		else if (app.currentView == "watch") {
+			app.view.watch.watch();
+		}
+	},
+
 	serialize: function() {
 		var username = $('#nickname-username').val();
 		return {
@@ -196,6 +255,7 @@ app.view.games = {
 		"list": $("#tpl-games-choose-container").html()
 	},
 	model: [],
+	version: null,
 
 	init: function(model) {
 		this.model = model || this.model;
@@ -214,7 +274,21 @@ app.view.games = {
 		app.channel.gamesListSock.onmessage = function(evt) {
 			obj = $.parseJSON(evt.data);
 			if (obj.status == 'ok'){
-				self.updateModel(obj.games);
+				if (obj.games !== undefined) {
+					self.version = obj.version;
+					self.updateModel(obj.games);
+				}
+				else if (self.version === null) {
+					return;
+				}
+				else if (obj.version == self.version + 1) {
+					self.version = obj.version;
+					self.applyDelta(obj);
+				}
+				else if (obj.version > self.version) {
+					// Some changes were missed, ask for the whole list.
+					app.channel.gamesListSock.send('');
+				}
 			}
 			else {
 				app.view.error.init(obj.errors);
@@ -241,6 +315,10 @@ app.view.games = {
 		$('#games-create').click(function() {
 			app.goto("details");
 		});
+
+		$('#games-watch').click(function() {
+			app.goto("watch", {"game_id": +$('#games-watch-id').val()});
+		});
 	},
 
 	render: function() {
@@ -270,7 +348,8 @@ app.view.games = {
 
 	serialize: function() {
 		return {
-			"game_id": +$('#games-choose').val()
+			"game_id": +$('#games-choose').val(),
+			"compact": true
 		};
 	},
 
@@ -279,6 +358,26 @@ app.view.games = {
 		this.renderList();
 	},
 
+	applyDelta: function(delta) {
+		var removed = delta.removed || [];
+		var model = $.grep(this.model, function(game) {
+			return $.inArray(game.game_id, removed) == -1;
+		});
+
+		$.each(delta.added || [], function(i, added) {
+			var exists = $.grep(model, function(game) {
+				return game.game_id == added.game_id;
+			}).length;
+			if (!exists) {
+				model.push(added);
+			}
+		});
+
+		model.sort(function(a, b) { return a.game_id - b.game_id; });
+		$.each(model, function(i, game) { delete game.first; });
+		this.updateModel(model);
+	},
+
 	empty: function() {
 		this.el.empty();
 	}
@@ -329,7 +428,8 @@ app.view.details = {
 		return {
 			"dimension": $('#details-dimension').val(),
 			"lineup": $('#details-lineup').val(),
-			"color": $('#details-color').val()
+			"color": $('#details-color').val(),
+			"opponent": $('#details-opponent').val()
 		};
 	},
 
@@ -343,12 +443,38 @@ app.view.game = {
 	el: $("#game"),
 	template: $("#tpl-game").html(),
 	model: {},
+	// Number of the last received move.
+	seq: 0,
 
 	init: function(model) {
 		this.model = model || this.model;
+		if (this.model.cells === undefined) {
+			this.model.cells = this.decodeBitmaps(this.model);
+		}
+		this.seq = this.model.cells.length;
 		this.render();
 	},
 
+	// Cells of the compact snapshot: base64 encoded bitmaps of the black
+	// and white stones, the first cell is the highest bit of the first byte.
+	decodeBitmaps: function(model) {
+		var d = model.dimension;
+		var cells = [];
+		$.each(["black", "white"], function(i, color) {
+			var bitmap = atob(model[color]);
+			for(var j = 0; j < d * d; j++) {
+				if (bitmap.charCodeAt(j >> 3) & (128 >> (j & 7))) {
+					cells.push({
+						"x": j % d + 1,
+						"y": Math.floor(j / d) + 1,
+						"color": color
+					});
+				}
+			}
+		});
+		return cells;
+	},
+
 	events: function() {
 		var self = this;
 
@@ -360,7 +486,10 @@ app.view.game = {
 		app.channel.gameActionSock.onmessage = function(evt) {
 			obj = $.parseJSON(evt.data);
 			if (obj.status == 'ok'){
-				aaa = {"x": "2", "y": "2", "color": "white"};
+				if (obj.seq <= self.seq) {
+					return;
+				}
+				self.seq = obj.seq;
 				self.putStone(obj.action);
 			}
 			else {
@@ -390,6 +519,9 @@ app.view.game = {
 				}
 				break;
 			}
+			if (obj.rank) {
+				$('#game-note').append(' Your position in the top: ' + obj.rank + '.');
+			}
 			$('#game-field').animate({"opacity": 0.3}, "slow");
 			$('[data-coordinates]:not([class])').off('click');
 		};
@@ -467,6 +599,96 @@ app.view.game = {
 };
 
 
+// Watch view: board snapshot, then moves of the game.
+app.view.watch = {
+	el: $("#game"),
+	template: $("#tpl-game").html(),
+	model: {},
+	seq: null,
+
+	init: function(model) {
+		this.model = model || this.model;
+		this.seq = null;
+		this.events();
+		this.watch();
+	},
+
+	watch: function() {
+		app.channel.gameWatchSock.send(
+			JSON.stringify({"game_id": this.model.game_id})
+		);
+	},
+
+	events: function() {
+		var self = this;
+
+		app.channel.gameWatchSock.onmessage = function(evt) {
+			obj = $.parseJSON(evt.data);
+			if (obj.status != 'ok') {
+				app.goto('games');
+				app.view.error.init(obj.errors);
+			}
+			else if (obj.game !== undefined) {
+				self.seq = obj.game.seq;
+				self.model = obj.game;
+				self.render();
+			}
+			else if (self.seq === null) {
+				return;
+			}
+			else if (obj.finish !== undefined) {
+				self.renderFinish(obj.finish.winner);
+			}
+			else if (obj.seq == self.seq + 1) {
+				self.seq = obj.seq;
+				app.view.game.putStone(obj.action);
+			}
+			else if (obj.seq > self.seq) {
+				// Some moves were missed, ask for the board again.
+				self.watch();
+			}
+		};
+	},
+
+	render: function() {
+		var d = this.model.dimension;
+		var cells = [];
+		for(var y = 1; y <= d; y++) {
+			for(var x = 1; x <= d; x++) {
+				cells.push(x + ":" + y);
+			}
+		}
+
+		this.el.html(Mustache.render(this.template, cells));
+
+		$.each(app.view.game.decodeBitmaps(this.model), function(i, cell) {
+			app.view.game.putStone(cell);
+		});
+
+		app.view.game.model = this.model;
+		app.view.game.setCellSize();
+		$('[data-coordinates]').off('click');
+		app.view.game.renderNote('Watching the game #' + this.model.game_id + '.');
+	},
+
+	renderFinish: function(winner) {
+		var back = ' <a href="#" onclick="app.goto(\'games\'); return false;">Back to games</a>.';
+		if (winner === null) {
+			app.view.game.renderNote('Draw!' + back);
+		}
+		else {
+			app.view.game.renderNote($('<span>').text(winner + ' won!').html() + back);
+		}
+		$('#game-field').animate({"opacity": 0.3}, "slow");
+	},
+
+	empty: function() {
+		app.channel.gameWatchSock.send(JSON.stringify({"game_id": null}));
+		this.el.empty();
+	}
+};
+
+
 // Initialize app.
 app.init();
 
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Client of the stats server's API.
+
+Requests have deadlines and at most `STATS_MAX_CLIENTS` of them run at
+once (see `clients.http_client`). After `STATS_MAX_FAILURES` failures in
+a row the circuit opens: requests fail at once for `STATS_RETRY_AFTER`
+seconds, then one request tries the server again. Failed request
+returns the last known answer, if any, so problems of the stats server
+don't hold the game server's coroutines.
+"""
+
+import json
+import logging
+import time
+from urllib.parse import urlencode, urljoin
+
+from tornado import gen
+from tornado.httpclient import HTTPRequest, HTTPError
+
+from clients import fetch
+import settings
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Count failures in a row and stop requests after too many of them."""
+
+    def __init__(self, max_failures, retry_after):
+        self.max_failures = max_failures
+        self.retry_after = retry_after
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self):
+        """Return True if the request can be sent (the circuit is closed
+        or it's time to try again).
+        """
+        if self.opened_at is None:
+            return True
+        if time.time() - self.opened_at >= self.retry_after:
+            # Only one trial request, others wait for its result.
+            self.opened_at = time.time()
+            return True
+        return False
+
+    def success(self):
+        if self.opened_at is not None:
+            logging.info('Stats server is available again.')
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.max_failures:
+            if self.opened_at is None:
+                logging.warning(
+                    'Stats server is unavailable, next try in %s seconds.',
+                    self.retry_after)
+            self.opened_at = time.time()
+
+
+breaker = CircuitBreaker(
+    settings.STATS_MAX_FAILURES, settings.STATS_RETRY_AFTER)
+
+# Last answers (ETag, data) by URL.
+answers = {}
+
+
+@gen.coroutine
+def get(path, **params):
+    """Return decoded JSON answer of the API method `path`. Unchanged
+    answer isn't sent again by the server (conditional GET by ETag).
+    Raises exception if the request failed and there is no last known
+    answer.
+    """
+    url = urljoin(settings.STATS_URL, path)
+    if params:
+        url = '{}?{}'.format(url, urlencode(sorted(params.items())))
+    etag, data = answers.get(url, (None, None))
+
+    if not breaker.allow():
+        if data is not None:
+            return data
+        raise CircuitOpenError('Stats server is unavailable.')
+
+    headers = {'If-None-Match': etag} if etag is not None else {}
+    request = HTTPRequest(
+        url, method='GET', headers=headers,
+        connect_timeout=settings.STATS_CONNECT_TIMEOUT,
+        request_timeout=settings.STATS_REQUEST_TIMEOUT)
+    try:
+        response = yield fetch(request)
+    except HTTPError as e:
+        if e.code != 304:
+            breaker.failure()
+            if data is not None:
+                logging.warning('Last known answer of %s is used: %s', url, e)
+                return data
+            raise
+    except Exception:
+        breaker.failure()
+        if data is not None:
+            logging.exception('Last known answer of %s is used.', url)
+            return data
+        raise
+    else:
+        data = json.loads(response.body.decode('utf-8'))
+        answers[url] = (response.headers.get('ETag'), data)
+
+    breaker.success()
+    return data
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Comparison of the game status detection (`play.Game`) with the
+original implementation, which scanned whole rows, columns and diagonals
+of the list matrix, on the seeded random games.
+
+    $ cd endpoints/game && python -m unittest test_play
+"""
+
+import random
+import unittest
+
+from play import Game
+
+
+class ReferenceGame:
+    """Original matrix implementation of the status detection."""
+    def __init__(self, dimension, lineup):
+        self.matrix = [[None] * dimension for i in range(dimension)]
+        self.dimension = dimension
+        self.lineup = lineup
+
+    def get_cell(self, x, y):
+        return self.matrix[y - 1][x - 1]
+
+    def action(self, x, y, color):
+        self.matrix[y - 1][x - 1] = color
+        return self.status(x, y, color)
+
+    def is_filled(self):
+        for row in self.matrix:
+            for stone in row:
+                if stone is None:
+                    return False
+        return True
+
+    def is_lineup(self, x, y, color):
+        # Horizontal roundtrip.
+        count = 0
+        for obj in self.matrix[y - 1]:
+            if obj == color:
+                count += 1
+                if count == self.lineup:
+                    return True
+            else:
+                count = 0
+
+        # Vertical roundtrip.
+        count = 0
+        for i in range(1, self.dimension + 1):
+            if self.get_cell(x, i) == color:
+                count += 1
+                if count == self.lineup:
+                    return True
+            else:
+                count = 0
+
+        # Diagonal roundtrip.
+        x1, y1 = 1, x + y - 1
+        x2, y2 = x + y - self.dimension, self.dimension
+        if y1 <= self.dimension:
+            pos_x, pos_y = x1, y1
+        else:
+            pos_x, pos_y = x2, y2
+
+        count = 0
+        while (pos_x <= self.dimension) and (pos_y >= 1):
+            if self.get_cell(pos_x, pos_y) == color:
+                count += 1
+                if count == self.lineup:
+                    return True
+            else:
+                count = 0
+            pos_x += 1
+            pos_y -= 1
+
+        # Anti-diagonal roundtrip.
+        x1, y1 = 1 + (x - y), 1
+        x2, y2 = 1, 1 - (x - y)
+        if x1 >= 1:
+            pos_x, pos_y = x1, y1
+        else:
+            pos_x, pos_y = x2, y2
+
+        count = 0
+        while (pos_x <= self.dimension) and (pos_y <= self.dimension):
+            if self.get_cell(pos_x, pos_y) == color:
+                count += 1
+                if count == self.lineup:
+                    return True
+            else:
+                count = 0
+            pos_x += 1
+            pos_y += 1
+
+        return False
+
+    def status(self, x, y, color):
+        if self.is_lineup(x, y, color):
+            return 'win'
+        if self.is_filled():
+            return 'draw'
+        return None
+
+
+class StatusTestCase(unittest.TestCase):
+    # Random games per dimension.
+    GAMES = 3
+
+    def play(self, dimension, lineup, rand):
+        """Play random game till its end, comparing status of every move
+        with the reference. Return the final status.
+        """
+        cells = [
+            (x, y)
+            for x in range(1, dimension + 1) for y in range(1, dimension + 1)
+        ]
+        rand.shuffle(cells)
+
+        game, reference = Game(None, dimension, lineup), \
+            ReferenceGame(dimension, lineup)
+        for i, (x, y) in enumerate(cells):
+            color = 1 - i % 2
+            ok, status = game.action(x, y, color)
+            self.assertTrue(ok)
+            self.assertEqual(
+                status, reference.action(x, y, color),
+                'dimension {}, lineup {}, move {} ({}, {})'.format(
+                    dimension, lineup, i + 1, x, y))
+            self.assertEqual(game.is_filled(), reference.is_filled())
+            if status is not None:
+                return status
+
+    def test_random_games(self):
+        rand = random.Random(0)
+        statuses = set()
+        for dimension in range(3, 31):
+            for i in range(self.GAMES):
+                lineup = rand.randint(3, min(dimension, 10))
+                statuses.add(self.play(dimension, lineup, rand))
+        self.assertEqual(statuses, {'win', 'draw'})
+
+    def test_long_lineups(self):
+        # Lineup of the whole dimension is mostly a draw.
+        rand = random.Random(1)
+        for dimension in range(3, 31):
+            self.play(dimension, dimension, rand)
+
+    def test_occupied_and_outside_cells(self):
+        game = Game(None, 3, 3)
+        self.assertEqual(game.action(1, 1, 1), (True, None))
+        self.assertEqual(game.action(1, 1, 0), (False, None))
+        self.assertEqual(game.action(0, 1, 0), (False, None))
+        self.assertEqual(game.action(4, 1, 0), (False, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Comparison of the game status detection of the move script
+(`redis_scripts.MOVE`) with the original implementation on the seeded
+random games. Needs the redis server of `settings`, its database
+`TEST_DB` is flushed. Tests are skipped without the server.
+
+    $ cd endpoints/game && python -m unittest test_redis_scripts
+"""
+
+import json
+import random
+import unittest
+
+import redis
+
+from play import Game
+from test_play import ReferenceGame
+import settings
+
+TEST_DB = 15
+
+KEYS = ['games:id:1', 'games:moves:1', 'games:activity']
+
+
+class MoveScriptTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = redis.StrictRedis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=TEST_DB)
+        try:
+            cls.client.ping()
+        except redis.ConnectionError:
+            raise unittest.SkipTest('Redis server is not available.')
+
+        from redis_scripts import MOVE
+        cls.move = MOVE
+
+    def setUp(self):
+        self.client.flushdb()
+
+    def tearDown(self):
+        self.client.flushdb()
+
+    def create_game(self, dimension, lineup, **fields):
+        """Game of alice (black, moves first) and bob."""
+        data = {
+            'creator': 'alice',
+            'opponent': 'bob',
+            'dimension': dimension,
+            'lineup': lineup,
+            'color': 'black',
+            'turn': 'alice'
+        }
+        data.update(fields)
+        self.client.hmset(KEYS[0], data)
+
+    def make_move(self, username, x, y, interval):
+        reply = self.client.eval(
+            self.move, len(KEYS), *(KEYS + [username, x, y, interval, 60,
+                                            0, 1]))
+        reply[1] = reply[1].decode('utf-8')
+        return reply
+
+    def stored_board(self, dimension):
+        """Board of the stored game: snapshot and moves after it."""
+        board, snapshot = self.client.hmget(KEYS[0], ['board', 'snapshot'])
+        if board is None:
+            game = Game(None, dimension)
+        else:
+            game = Game.from_bytes(board, dimension)
+        game.apply_moves(
+            self.client.lrange(KEYS[1], int(snapshot or 0), -1))
+        return game.to_bytes()
+
+    def play(self, dimension, lineup, cells, reference, interval, moves=0):
+        """Play the game on the cells till its end, comparing status of
+        every move with the reference. `moves` is the number of stones
+        already on the board. Return the final status.
+        """
+        for i, (x, y) in enumerate(cells):
+            color = 1 - (moves + i) % 2
+            reply = self.make_move(
+                'alice' if color else 'bob', x, y, interval)
+            self.assertEqual(reply[0], b'ok', reply[1])
+
+            status = reference.action(x, y, color)
+            self.assertEqual(
+                reply[9].decode('utf-8') if len(reply) > 9 else None,
+                status,
+                'dimension {}, lineup {}, move {} ({}, {})'.format(
+                    dimension, lineup, moves + i + 1, x, y))
+            if status is not None:
+                self.assertFalse(self.client.exists(KEYS[0]))
+                self.assertFalse(self.client.exists(KEYS[1]))
+                return status
+
+            board = Game(reference.matrix, dimension).to_bytes()
+            self.assertEqual(self.stored_board(dimension), board)
+
+    def random_cells(self, dimension, rand):
+        cells = [
+            (x, y)
+            for x in range(1, dimension + 1) for y in range(1, dimension + 1)
+        ]
+        rand.shuffle(cells)
+        return cells
+
+    def test_random_games(self):
+        rand = random.Random(0)
+        statuses = set()
+        for dimension in range(3, 31):
+            lineup = rand.randint(3, min(dimension, 10))
+            self.create_game(dimension, lineup)
+            statuses.add(self.play(
+                dimension, lineup, self.random_cells(dimension, rand),
+                ReferenceGame(dimension, lineup), rand.choice([1, 5, 32])))
+            self.client.flushdb()
+        self.assertEqual(statuses, {'win', 'draw'})
+
+    def test_long_lineups(self):
+        # Lineup of the whole dimension is mostly a draw.
+        rand = random.Random(1)
+        for dimension in range(3, 16):
+            self.create_game(dimension, dimension)
+            self.play(
+                dimension, dimension, self.random_cells(dimension, rand),
+                ReferenceGame(dimension, dimension), 32)
+            self.client.flushdb()
+
+    def test_legacy_games(self):
+        # Games saved before the moves list: their stones are only on the
+        # board (or in the JSON matrix).
+        rand = random.Random(2)
+        for i in range(20):
+            dimension = rand.randint(3, 12)
+            lineup = rand.randint(3, dimension)
+            cells = self.random_cells(dimension, rand)
+
+            # Stones of the game, which isn't finished yet.
+            game = Game(None, dimension, lineup)
+            for x, y in cells[:rand.randint(1, len(cells) - 1)]:
+                started = game.copy()
+                if game.action(x, y, 1 - started.moves % 2)[1] is not None:
+                    game = started
+                    break
+
+            reference = ReferenceGame(dimension, lineup)
+            reference.matrix = game.matrix
+            turn = 'bob' if game.moves % 2 else 'alice'
+            if i % 2:
+                self.create_game(
+                    dimension, lineup, turn=turn,
+                    matrix=json.dumps(game.matrix))
+            else:
+                self.create_game(
+                    dimension, lineup, turn=turn, board=game.to_bytes())
+            self.play(
+                dimension, lineup, cells[game.moves:], reference, 5,
+                game.moves)
+            self.client.flushdb()
+
+    def test_occupied_and_outside_cells(self):
+        self.create_game(3, 3)
+        self.assertEqual(self.make_move('alice', 1, 1, 32)[0], b'ok')
+        self.assertEqual(
+            self.make_move('bob', 1, 1, 32), [b'error', 'Bad action.'])
+        self.assertEqual(
+            self.make_move('bob', 0, 1, 32), [b'error', 'Bad action.'])
+        self.assertEqual(
+            self.make_move('bob', 4, 1, 32), [b'error', 'Bad action.'])
+
+
+if __name__ == '__main__':
+    unittest.main()
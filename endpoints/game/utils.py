@@ -1,13 +1,38 @@
 # -*- coding: utf-8 -*-
 
 import os
+from itertools import combinations
 
 
 def rel(*x):
     return os.path.join(os.path.abspath(os.path.dirname(__file__)), *x)
 
 
-def hgetall_group_by(lst):
-    """List of data from redis hash to dict."""
-    lst = [i.decode('utf-8') for i in lst]
-    return dict(zip(*[lst[i::2] for i in range(2)]))
+LOBBY_FILTERS = ('color', 'dimension', 'lineup')
+
+
+def lobby_key(filters):
+    """Redis key of the lobby index (sorted set of game ids) for the
+    `filters` dict, for example 'games:lobby:color=black:lineup=5'.
+    """
+    parts = ['{}={}'.format(i, filters[i])
+             for i in LOBBY_FILTERS if filters.get(i) is not None]
+    return ':'.join(['games:lobby'] + parts)
+
+
+def lobby_keys(game):
+    """All lobby index keys of the game: one for every combination of
+    the filters, so any filtered page is read from a single index.
+    """
+    return [
+        lobby_key({i: game[i] for i in fields})
+        for count in range(len(LOBBY_FILTERS) + 1)
+        for fields in combinations(LOBBY_FILTERS, count)
+    ]
+
+
+def open_games_key(username):
+    """Redis key of the index of the player's games waiting for the
+    opponent, they are removed with the player.
+    """
+    return 'games:open:{}'.format(username)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from django.db import models
+from django.utils import six
+
+# Binary column types by the database vendor.
+BINARY_TYPES = {
+    'postgresql': 'bytea',
+    'mysql': 'longblob',
+    'oracle': 'BLOB',
+    'sqlite': 'BLOB',
+}
+
+
+def pack_moves(moves):
+    """Pack list of [x, y] moves into 2 bytes per move. Black moves
+    first, so colors are known from the order.
+    """
+    return bytes(i for move in moves for i in move)
+
+
+def unpack_moves(data):
+    """Return list of [x, y] moves of the `pack_moves` data (bytes or
+    buffer returned by the database driver), or None for NULL (rounds
+    saved without the moves).
+    """
+    if data is None:
+        return None
+    data = bytearray(data)
+    return [[data[i], data[i + 1]] for i in range(0, len(data), 2)]
+
+
+class MovesField(six.with_metaclass(models.SubfieldBase, models.Field)):
+    """Moves of the round packed by `pack_moves` into the binary column
+    (Django 1.5 has no BinaryField). Python value is list of [x, y].
+    """
+    description = 'Packed moves'
+
+    def db_type(self, connection):
+        return BINARY_TYPES.get(connection.vendor, 'BLOB')
+
+    def to_python(self, value):
+        if isinstance(value, list):
+            return value
+        return unpack_moves(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        return connection.Database.Binary(pack_moves(value))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import time
+from optparse import make_option
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from ...utils import validate_round, save_rounds
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Worker, which saves finished rounds queued by the game server.
+
+    Rounds are moved to the processing list while they are saved, so
+    rounds of the failed batch are not lost: they are saved one by one,
+    and if the database is unavailable, returned to the queue and retried
+    later. Invalid rounds and rounds, which fail with the working
+    database, are moved to the `:failed` list. Only one worker should
+    drain the queue.
+    """
+    help = 'Save finished rounds queued by the game server.'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--once', action='store_true', dest='once', default=False,
+            help='Exit when the queue is empty.'),
+    )
+
+    def handle(self, *args, **options):
+        client = redis.StrictRedis(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+        queue = settings.ROUNDS_QUEUE
+        processing = '{}:processing'.format(queue)
+        failed = '{}:failed'.format(queue)
+
+        # Rounds left by the stopped worker.
+        while client.rpoplpush(processing, queue):
+            pass
+
+        delay = 1
+        while True:
+            raw = client.brpoplpush(
+                queue, processing, timeout=1 if options['once'] else 0)
+            if raw is None:
+                break
+
+            batch = [raw]
+            while len(batch) < settings.ROUNDS_BATCH_SIZE:
+                raw = client.rpoplpush(queue, processing)
+                if raw is None:
+                    break
+                batch.append(raw)
+
+            invalid, unsaved = self.save_batch(batch)
+            if unsaved and not self.database_is_available():
+                logger.error(
+                    'Rounds are not saved, retry in %s seconds.', delay)
+                pipe = client.pipeline()
+                for raw in batch:
+                    pipe.lrem(processing, 1, raw)
+                for raw in reversed(unsaved):
+                    pipe.rpush(queue, raw)
+                for raw in invalid:
+                    pipe.lpush(failed, raw)
+                pipe.execute()
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+
+            # Database works, so the unsaved rounds are broken (they would
+            # block the queue forever).
+            delay = 1
+            pipe = client.pipeline()
+            for raw in batch:
+                pipe.lrem(processing, 1, raw)
+            for raw in invalid + unsaved:
+                pipe.lpush(failed, raw)
+            pipe.execute()
+
+    def save_batch(self, batch):
+        """Save rounds of the batch. If it fails, rounds are saved one by
+        one. Return lists of the invalid and unsaved rounds.
+        """
+        invalid, rounds = [], []
+        for raw in batch:
+            try:
+                data = json.loads(raw.decode('utf-8'))
+                error = validate_round(data)
+            except ValueError:
+                error = 'JSON is expected'
+
+            if error:
+                logger.error('Wrong round %r: %s', raw, error)
+                invalid.append(raw)
+            else:
+                rounds.append((raw, data))
+
+        if not rounds:
+            return invalid, []
+        try:
+            save_rounds([data for raw, data in rounds])
+            return invalid, []
+        except Exception:
+            logger.exception('Batch of rounds is not saved.')
+
+        unsaved = []
+        for raw, data in rounds:
+            try:
+                save_rounds([data])
+            except Exception:
+                logger.exception('Round %r is not saved.', raw)
+                unsaved.append(raw)
+        return invalid, unsaved
+
+    def database_is_available(self):
+        try:
+            connection.cursor().execute('SELECT 1')
+        except Exception:
+            connection.close()
+            return False
+        return True
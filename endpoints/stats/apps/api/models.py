@@ -4,6 +4,8 @@ from django.db import models
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
 
+from .fields import MovesField
+
 
 class Round(models.Model):
     creator = models.ForeignKey(
@@ -21,6 +23,7 @@ class Round(models.Model):
     winner = models.ForeignKey(
         User, verbose_name='Winner', related_name='win_rounds',
         blank=True, null=True, on_delete=models.SET_NULL)
+    moves = MovesField('Moves', blank=True, null=True, editable=False)
 
     def __unicode__(self):
         return '{0}x{0} ({1})'.format(self.dimension, self.lineup)
@@ -32,8 +35,9 @@ class Round(models.Model):
 
 class PlayerPosition(models.Model):
     player = models.ForeignKey(
-        User, verbose_name='Player', related_name='player_positions')
-    wins = models.PositiveIntegerField('Wins', default=0)
+        User, verbose_name='Player', related_name='player_positions',
+        unique=True)
+    wins = models.PositiveIntegerField('Wins', default=0, db_index=True)
     losses = models.PositiveIntegerField('Losses', default=0)
     draws = models.PositiveIntegerField('Draws', default=0)
 
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+
+from .models import Round, PlayerPosition
+from .utils import save_rounds, save_player_stats, iter_rounds
+
+
+def savepoint_queries(count):
+    """Queries of `count` savepoints (created and released), the sqlite
+    backend doesn't use them.
+    """
+    return count * 2 if connection.features.uses_savepoints else 0
+
+
+def round_data(creator='alice', opponent='bob', winner='alice'):
+    return {
+        'creator': creator,
+        'opponent': opponent,
+        'dimension': 3,
+        'lineup': 3,
+        'lead': creator,
+        'winner': winner,
+        'moves': [[1, 1], [2, 1], [1, 2], [2, 2], [1, 3]]
+    }
+
+
+class SaveRoundsTestCase(TestCase):
+    def create_players(self, *usernames):
+        for username in usernames:
+            user = User.objects.create(username=username)
+            PlayerPosition.objects.create(player=user)
+
+    def assertPosition(self, username, wins, losses, draws):
+        position = PlayerPosition.objects.get(player__username=username)
+        self.assertEqual(
+            [position.wins, position.losses, position.draws],
+            [wins, losses, draws])
+
+    def test_existing_players(self):
+        self.create_players('alice', 'bob')
+        # Users, rounds and one update per player.
+        with self.assertNumQueries(4):
+            save_rounds([round_data()])
+
+        self.assertPosition('alice', 1, 0, 0)
+        self.assertPosition('bob', 0, 1, 0)
+        saved = Round.objects.get()
+        self.assertEqual(saved.winner.username, 'alice')
+        self.assertEqual(saved.moves, round_data()['moves'])
+
+    def test_new_players(self):
+        # Plus get and insert of every user, and insert of every
+        # position after the update of nothing.
+        with self.assertNumQueries(4 + 4 + 2 + savepoint_queries(4)):
+            save_rounds([round_data()])
+
+        self.assertPosition('alice', 1, 0, 0)
+        self.assertPosition('bob', 0, 1, 0)
+
+    def test_draw(self):
+        self.create_players('alice', 'bob')
+        with self.assertNumQueries(4):
+            save_rounds([round_data(winner=None)])
+
+        self.assertPosition('alice', 0, 0, 1)
+        self.assertPosition('bob', 0, 0, 1)
+        self.assertIsNone(Round.objects.get().winner)
+
+    def test_batch(self):
+        # Number of queries doesn't depend on the number of rounds.
+        self.create_players('alice', 'bob')
+        with self.assertNumQueries(4):
+            save_rounds([
+                round_data(),
+                round_data('bob', 'alice', 'bob'),
+                round_data(winner=None)])
+
+        self.assertEqual(Round.objects.count(), 3)
+        self.assertPosition('alice', 1, 1, 1)
+        self.assertPosition('bob', 1, 1, 1)
+
+    def test_concurrent_increments(self):
+        self.create_players('alice')
+        user = User.objects.get(username='alice')
+        # Both writers read the position before any of them saved.
+        first = PlayerPosition.objects.get(player=user)
+        second = PlayerPosition.objects.get(player=user)
+
+        with self.assertNumQueries(1):
+            save_player_stats({first.player_id: [1, 0, 0]})
+        with self.assertNumQueries(1):
+            save_player_stats({second.player_id: [0, 1, 1]})
+
+        self.assertPosition('alice', 1, 1, 1)
+
+
+class IterRoundsTestCase(TestCase):
+    def test_moves(self):
+        data = round_data()
+        del data['moves']
+        save_rounds([round_data(), data])
+
+        rounds = list(iter_rounds())
+        self.assertEqual(rounds[0]['moves'], round_data()['moves'])
+        # Round saved without the moves isn't a round without moves.
+        self.assertIsNone(rounds[1]['moves'])
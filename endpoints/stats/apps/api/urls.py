@@ -6,4 +6,6 @@ urlpatterns = patterns(
     '',
     url(r'^round/save$', 'apps.api.views.round_save', name='round_save'),
     url(r'^player/top$', 'apps.api.views.player_top', name='player_top'),
+    url(r'^round/replay$', 'apps.api.views.round_replay',
+        name='round_replay'),
 )
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.contrib.auth.models import User
+
+from .fields import unpack_moves
+from .models import Round, PlayerPosition
+
+ROUND_KEYS = [
+    'creator', 'opponent', 'dimension', 'lineup',
+    'lead', 'winner']
+
+# Max length of `User.username`.
+USERNAME_LENGTH = User._meta.get_field('username').max_length
+
+# Rounds queued by the older game servers have no moves.
+OPTIONAL_ROUND_KEYS = ['moves']
+
+
+def validate_round(data):
+    """Return error message for the wrong round data or None."""
+    if not isinstance(data, dict) or \
+            not set(ROUND_KEYS) <= set(data.keys()) <= \
+            set(ROUND_KEYS + OPTIONAL_ROUND_KEYS):
+        return 'Wrong JSON keys.'
+
+    usernames = [data[key] for key in ['creator', 'opponent', 'lead']]
+    if data['winner']:
+        usernames.append(data['winner'])
+    if not all(isinstance(i, str) and 0 < len(i) <= USERNAME_LENGTH
+               for i in usernames) or \
+            not all(isinstance(data[key], int) and data[key] >= 3
+                    for key in ['dimension', 'lineup']) or \
+            data['lineup'] > data['dimension']:
+        return 'Wrong JSON value.'
+
+    if (data['creator'] == data['opponent']) or \
+            (data['winner'] and
+             data['winner'] not in [data['creator'], data['opponent']]):
+        return 'Wrong JSON value.'
+
+    if 'moves' in data and \
+            not validate_moves(data['moves'], data['dimension']):
+        return 'Wrong JSON value.'
+
+    return None
+
+
+def validate_moves(moves, dimension):
+    """Check list of [x, y] moves of the round."""
+    if not isinstance(moves, list) or not isinstance(dimension, int) or \
+            len(moves) > dimension * dimension:
+        return False
+
+    for move in moves:
+        if not isinstance(move, list) or len(move) != 2 or \
+                not all(isinstance(i, int) and 1 <= i <= dimension
+                        for i in move):
+            return False
+    return True
+
+
+def save_player_stats(stats):
+    """Add wins, losses and draws to the players stats. `stats` is a dict:
+    user id -> [wins, losses, draws]. Increments are done by the database
+    (F() expressions), so concurrent updates are not lost.
+    """
+    for player_id, (wins, losses, draws) in stats.items():
+        updated = PlayerPosition.objects.filter(player_id=player_id).update(
+            wins=F('wins') + wins,
+            losses=F('losses') + losses,
+            draws=F('draws') + draws)
+        if updated:
+            continue
+
+        # First round of the player. Someone may create the position at the
+        # same time, then the unique `player` fails and we update it.
+        sid = transaction.savepoint()
+        try:
+            PlayerPosition.objects.create(
+                player_id=player_id, wins=wins, losses=losses, draws=draws)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            PlayerPosition.objects.filter(player_id=player_id).update(
+                wins=F('wins') + wins,
+                losses=F('losses') + losses,
+                draws=F('draws') + draws)
+
+
+def get_users(usernames):
+    """Return dict: username -> user, creating missing users."""
+    users = {
+        i.username: i for i in User.objects.filter(username__in=usernames)}
+    for username in set(usernames) - set(users):
+        users[username], created = \
+            User.objects.get_or_create(username=username)
+    return users
+
+
+def save_rounds(rounds):
+    """Save list of the valid rounds (see `validate_round`) and update
+    players stats in one transaction. Queries don't depend on the number
+    of rounds: one for users, one for rounds and one per player (plus
+    creation of the new users and positions).
+    """
+    with transaction.commit_on_success():
+        users = get_users(set(
+            data[key] for data in rounds
+            for key in ['creator', 'opponent', 'lead', 'winner']
+            if data[key]))
+
+        Round.objects.bulk_create([
+            Round(
+                creator=users[data['creator']],
+                opponent=users[data['opponent']],
+                dimension=data['dimension'],
+                lineup=data['lineup'],
+                lead=users[data['lead']],
+                winner=users.get(data['winner']),
+                moves=data.get('moves'))
+            for data in rounds
+        ])
+
+        stats = defaultdict(lambda: [0, 0, 0])
+        for data in rounds:
+            for key in ['creator', 'opponent']:
+                player_stats = stats[users[data[key]].pk]
+                if not data['winner']:
+                    player_stats[2] += 1
+                elif data['winner'] == data[key]:
+                    player_stats[0] += 1
+                else:
+                    player_stats[1] += 1
+        save_player_stats(stats)
+
+
+def iter_rounds(after=0, limit=None):
+    """Yield rounds (dicts with the usernames and moves) with id greater
+    than `after`, ordered by id. Rounds are fetched by chunks of
+    `REPLAY_CHUNK_SIZE` rows, so any number of rounds can be read.
+    """
+    fields = [
+        'id', 'creator__username', 'opponent__username', 'dimension',
+        'lineup', 'lead__username', 'winner__username', 'moves']
+    while limit is None or limit > 0:
+        size = settings.REPLAY_CHUNK_SIZE
+        if limit is not None:
+            size = min(size, limit)
+            limit -= size
+
+        chunk = list(
+            Round.objects.filter(id__gt=after).order_by('id')
+            .values_list(*fields)[:size])
+        for row in chunk:
+            yield {
+                'id': row[0],
+                'creator': row[1],
+                'opponent': row[2],
+                'dimension': row[3],
+                'lineup': row[4],
+                'lead': row[5],
+                'winner': row[6],
+                'moves': unpack_moves(row[7])
+            }
+
+        if len(chunk) < size:
+            break
+        after = chunk[-1][0]
@@ -2,85 +2,92 @@
 
 import json
 
-from django.http import HttpResponse, HttpResponseServerError
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import (
+    HttpResponse, HttpResponseServerError, HttpResponseNotModified,
+    StreamingHttpResponse)
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.http import require_http_methods
-from django.contrib.auth.models import User
 
 from .models import Round, PlayerPosition
 from .decorators import expect_json
-
-
-def save_player_stats(creator, opponent, winner):
-    if winner:
-        looser = opponent if winner == creator else creator
-
-        player_pos, created = PlayerPosition.objects.get_or_create(
-            player=winner, defaults={'wins': 1})
-        if not created:
-            player_pos.wins += 1
-            player_pos.save(update_fields=['wins'])
-
-        player_pos, created = PlayerPosition.objects.get_or_create(
-            player=looser, defaults={'losses': 1})
-        if not created:
-            player_pos.losses += 1
-            player_pos.save(update_fields=['losses'])
-    else:
-        for player in [creator, opponent]:
-            player_pos, created = PlayerPosition.objects.get_or_create(
-                player=player, defaults={'draws': 1})
-            if not created:
-                player_pos.draws += 1
-                player_pos.save(update_fields=['draws'])
+from .utils import validate_round, save_rounds, iter_rounds
 
 
 @require_http_methods(["POST"])
 @expect_json
 def round_save(request):
-    ALLOWED_KEYS = [
-        'creator', 'opponent', 'dimension', 'lineup',
-        'lead', 'winner']
     data = request.json_post_data
 
-    if set(ALLOWED_KEYS) != set(data.keys()):
-        return HttpResponseServerError('Wrong JSON keys.')
-
-    creator, created = User.objects.get_or_create(username=data['creator'])
-    opponent, created = User.objects.get_or_create(username=data['opponent'])
-    dimension = data['dimension']
-    lineup = data['lineup']
-    lead, created = User.objects.get_or_create(
-        username=data['lead'])
-
-    winner = None
-    if data['winner']:
-        winner, created = User.objects.get_or_create(
-            username=data['winner'])
+    error = validate_round(data)
+    if error:
+        return HttpResponseServerError(error)
 
-    if (creator == opponent) or (winner and winner not in [creator, opponent]):
-        return HttpResponseServerError('Wrong JSON value.')
-
-    Round.objects.create(
-        creator=creator, opponent=opponent, dimension=dimension,
-        lineup=lineup, lead=lead, winner=winner)
-
-    save_player_stats(creator, opponent, winner)
+    save_rounds([data])
 
     return HttpResponse()
 
 
 @require_http_methods(["GET"])
 def player_top(request):
-    count = int(request.GET.get('count', 10))
-    top = PlayerPosition.objects.order_by('-wins')[:count]
-    answer = [
-        {
-            'player': i.player.username,
-            'quantity': i.wins + i.losses + i.draws,
-            'wins': i.wins,
-            'losses': i.losses,
-            'draws': i.draws
-
-        } for i in top
-    ]
-    return HttpResponse(json.dumps(list(answer)), mimetype="application/json")
+    """Top of the players by wins. Stats change only when rounds are
+    saved, so the id of the last round is used as the version of the top:
+    it's the ETag and the cache key of the serialized answer. Rounds saved
+    at once (`round/save` and `drain_rounds`) can be committed not in the
+    order of their ids, so the top cached before the commit of the round
+    with the smaller id stays until the next round is saved.
+    """
+    try:
+        count = int(request.GET.get('count', 10))
+    except ValueError:
+        return HttpResponseServerError('Wrong query.')
+    if not 1 <= count <= settings.PLAYER_TOP_MAX_COUNT:
+        return HttpResponseServerError('Wrong query.')
+
+    last_round = Round.objects.aggregate(last=Max('id'))['last'] or 0
+
+    etag = '{}-{}'.format(last_round, count)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        return HttpResponseNotModified()
+
+    key = 'player_top:{}'.format(etag)
+    content = cache.get(key)
+    if content is None:
+        top = PlayerPosition.objects.select_related(
+            'player').order_by('-wins')[:count]
+        answer = [
+            {
+                'player': i.player.username,
+                'quantity': i.wins + i.losses + i.draws,
+                'wins': i.wins,
+                'losses': i.losses,
+                'draws': i.draws
+
+            } for i in top
+        ]
+        content = json.dumps(answer)
+        cache.set(key, content)
+
+    response = HttpResponse(content, mimetype="application/json")
+    response['ETag'] = quote_etag(etag)
+    return response
+
+
+@require_http_methods(["GET"])
+def round_replay(request):
+    """Rounds with their moves as JSON lines (one round per line), ordered
+    by id. `after` is the id of the last received round, `limit` is the
+    maximum number of rounds (all by default). The answer is streamed.
+    """
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = request.GET.get('limit')
+        limit = None if limit is None else int(limit)
+    except ValueError:
+        return HttpResponseServerError('Wrong query.')
+
+    lines = (
+        json.dumps(data) + '\n' for data in iter_rounds(after, limit))
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
@@ -160,6 +160,20 @@ LOGGING = {
     }
 }
 
+# Queue of the finished rounds, filled by the game server and drained
+# by the `drain_rounds` management command.
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+ROUNDS_QUEUE = 'rounds:queue'
+ROUNDS_BATCH_SIZE = 100
+
+# Rounds fetched by one query of the `round/replay` stream.
+REPLAY_CHUNK_SIZE = 500
+
+# Maximum number of players in the `player/top` answer (the game server
+# fills its leaderboard with `STATS_SEED_COUNT` players).
+PLAYER_TOP_MAX_COUNT = 100000
+
 try:
     from .settings_local import *
 except ImportError: